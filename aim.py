@@ -0,0 +1,175 @@
+import argparse
+import time
+
+import numpy as np
+
+from impact_table import drag_scaling, impact_x, vertical_solution
+
+# Launch parameters that put the impact point on a target: the inverse of
+# Scenario2D.shoot and Scenario3D.shoot. A grid of candidates brackets every
+# solution, then all brackets are bisected at once. Each step is a single
+# vectorized evaluation of the closed-form solution (see
+# impact_table.vertical_solution and impact_x).
+#
+# Solutions closer together than the candidate spacing can be missed, such
+# as the two arcs of a target right at the maximum range.
+
+ANGLES = (15, 175)  # launch angles of the problems, see Parameters.new
+SPEEDS = (1e-3, 1000)
+CANDIDATES = 512
+
+
+def _roots(f, lb, ub, n=CANDIDATES, xtol=1e-9, max_iter=100):
+    # Every x in [lb, ub] where f changes sign; f maps an array of x to an
+    # array of values
+    x = np.linspace(lb, ub, n)
+    y = f(x)
+    bracket = np.isfinite(y[:-1]) & np.isfinite(y[1:]) & \
+        (np.signbit(y[:-1]) != np.signbit(y[1:]))
+    lo, hi, y_lo = x[:-1][bracket], x[1:][bracket], y[:-1][bracket]
+
+    for _ in range(max_iter):
+        if not lo.size or np.max(hi - lo) <= xtol:
+            break
+        mid = 0.5 * (lo + hi)
+        y_mid = f(mid)
+        right = np.signbit(y_mid) == np.signbit(y_lo)  # root in [mid, hi]
+        lo = np.where(right, mid, lo)
+        y_lo = np.where(right, y_mid, y_lo)
+        hi = np.where(right, hi, mid)
+    return 0.5 * (lo + hi)
+
+
+def _setup(scenario):
+    # Drag scaling, wind and the time step whose first-order error the
+    # solutions reproduce: that of the Euler loop, none for the other engines
+    if scenario.wind is None:
+        raise ValueError('Aiming needs a scenario with drag')
+    s = drag_scaling(scenario.mass, scenario.rho, scenario.A, scenario.drag_coeff)
+    dt = scenario.dt if scenario.engine == 'euler' else 0.0
+    return s, np.asarray(scenario.wind, dtype=np.float64), dt
+
+
+def _z_stop(dt):
+    # The Euler loop stops below z = 0.0001 (see Scenario._simulate_impact)
+    return 0.0001 if dt else 0.0
+
+
+def impact_2d(scenario, angle, speed, g=9.82):
+    # Impact x of scenario.shoot(angle, speed), broadcast over angle and speed
+    s, wind, dt = _setup(scenario)
+    rads = np.deg2rad(angle)
+    t, vz1, dz = vertical_solution(s, np.sin(rads) * speed, g)
+    x, _, _ = impact_x(s, np.cos(rads) * speed, wind[0], t, vz1, dz, dt, _z_stop(dt))
+    return x
+
+
+def aim_angle(scenario, target, speed, bounds=ANGLES, n=CANDIDATES, g=9.82):
+    # Launch angles [deg] at the given speed whose impact x is target, low
+    # arcs first
+    return _roots(lambda angle: impact_2d(scenario, angle, speed, g) - target, *bounds, n)
+
+
+def aim_speed(scenario, target, angle, bounds=SPEEDS, n=CANDIDATES, g=9.82):
+    # Launch speeds [m/s] at the given angle whose impact x is target
+    return _roots(lambda speed: impact_2d(scenario, angle, speed, g) - target, *bounds, n)
+
+
+def _drift_inverse(s, d, t):
+    # Relative launch velocity u0 that drifts a distance d in time t, from
+    # d = sign(u0) * log(1 + s |u0| t) / s (see analytic._drift)
+    return np.sign(d) * np.expm1(s * np.abs(d)) / (s * t)
+
+
+def _launch_velocity(s, wind, target, t, vz1, dz, dt, iterations=3):
+    # Launch velocity along one horizontal axis that lands on target at time
+    # t. The Euler term is O(dt), so a few fixed-point steps account for it.
+    # Out of reach at time t, u0 overflows to inf and the mismatch is NaN
+    offset = 0.0
+    with np.errstate(over='ignore', invalid='ignore'):
+        for _ in range(iterations if dt else 0):
+            vx0 = wind + _drift_inverse(s, target - offset - wind * t, t)
+            x, _, _ = impact_x(s, vx0, wind, t, vz1, dz, dt, _z_stop(dt))
+            offset = offset + x - target
+        return wind + _drift_inverse(s, target - offset - wind * t, t)
+
+
+def aim_3d(scenario, target, speed, bounds=ANGLES, n=CANDIDATES, g=9.82):
+    # (phi, theta) pairs [deg] at the given speed whose impact (x, y) is
+    # target, as an (N, 2) array in the argument order of Scenario3D.shoot.
+    #
+    # The vertical motion only depends on theta, and each horizontal axis is
+    # closed-form given the time of impact, so the search is over theta
+    # alone: the horizontal speed needed to reach the target must be the
+    # speed * |cos(theta)| that is available. theta and 180 - theta with phi
+    # turned half a turn are the same shot; both are returned when in bounds.
+    s, wind, dt = _setup(scenario)
+    target_x, target_y = target
+
+    def launch(theta):
+        t, vz1, dz = vertical_solution(s, np.sin(np.deg2rad(theta)) * speed, g)
+        vx0 = _launch_velocity(s, wind[0], target_x, t, vz1, dz, dt)
+        vy0 = _launch_velocity(s, wind[1], target_y, t, vz1, dz, dt)
+        return vx0, vy0
+
+    def mismatch(theta):
+        vx0, vy0 = launch(theta)
+        return speed * np.abs(np.cos(np.deg2rad(theta))) - np.hypot(vx0, vy0)
+
+    theta = _roots(mismatch, *bounds, n)
+    vx0, vy0 = launch(theta)
+    cos = np.cos(np.deg2rad(theta))
+    phi = np.rad2deg(np.arctan2(vy0 / cos, vx0 / cos)) % 360
+    return np.stack([phi, theta], axis=-1)
+
+
+def check(count, seed):
+    # Aims at the impact points of random scenarios of every problem, which
+    # must recover the shot they were simulated with, and shoots the
+    # solutions to see how close they land
+    from problems import PROBLEM_CLASSES
+
+    rng = np.random.default_rng(seed)
+    for kind in ('problem1', 'problem2', 'problem3'):
+        problem = PROBLEM_CLASSES[kind]
+        states = problem().sample_states(rng, count)
+
+        shot_errors, misses, solutions, wall = [], [], [], 0.0
+        for scenario_state in states:
+            scenario = problem.scenario(scenario_state)
+            shot = problem.shot(scenario_state)
+            xyz = problem.simulate(scenario_state)
+
+            axes = 2 if kind == 'problem3' else 1
+            t0 = time.perf_counter()
+            if kind == 'problem3':
+                found = aim_3d(scenario, xyz[:2, -1], shot[-1])
+            else:
+                found = aim_angle(scenario, xyz[0, -1], shot[-1])[:, None]
+            wall += time.perf_counter() - t0
+
+            solutions.append(len(found))
+            if not len(found):
+                shot_errors.append(np.inf)
+                continue
+            shot_errors.append(np.min(np.max(np.abs(found - shot[:-1]), axis=-1)))
+            for angles in found:
+                landed = scenario.shoot(*angles, shot[-1], record='impact')
+                misses.append(np.max(np.abs(landed[:axes, -1] - xyz[:axes, -1])))
+
+        print(f'{kind}: {len(states)} scenarios, {np.mean(solutions):.2f} solutions each, '
+              f'{1e3 * wall / len(states):.1f} ms to aim, '
+              f'max shot error {np.max(shot_errors):.2e} deg, '
+              f'max miss {np.max(misses):.4f} m')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the aiming solver on random scenarios')
+    parser.add_argument('--count', type=int, default=20, help='scenarios per problem')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    check(args.count, args.seed)
+
+
+if __name__ == '__main__':
+    main()
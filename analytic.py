@@ -0,0 +1,184 @@
+import numpy as np
+
+from wind import WindField
+
+LOG_2 = np.log(2)
+
+
+def _log_cosh(x):
+    x = np.abs(x)
+    return x + np.log1p(np.exp(-2 * x)) - LOG_2
+
+
+def _log_sinh(x):
+    # Only defined for x > 0
+    return x + np.log1p(-np.exp(-2 * x)) - LOG_2
+
+
+def _drift(x0, u0, w, s, t):
+    # Horizontal axis: u = v - w obeys u' = -s * u * |u|, which gives
+    #   u(t) = u0 / (1 + s |u0| t)
+    #   x(t) = x0 + w t + sign(u0) * log(1 + s |u0| t) / s
+    with np.errstate(divide='ignore', invalid='ignore'):
+        spread = s * np.abs(u0) * t
+        x_rel = np.where(s > 0, np.sign(u0) * np.log1p(spread) / s, u0 * t)
+        v = w + u0 / (1 + spread)
+    x = x0 + w * t + x_rel
+    return x, v
+
+
+class AnalyticProjectile():
+    # Closed-form solution of the model that Projectile integrates with Euler.
+    # Drag acts on every axis separately, so each axis is an independent 1-D
+    # ODE in the velocity relative to the wind, u = v - v_wind:
+    #   x, y: u' = -s u |u|
+    #   z:    u' = -s u |u| - g
+    # with s = rho * drag_coeff * A / (2 * mass). Gravity makes the z axis a
+    # tan (ascent) followed by a tanh/coth (descent) solution.
+    #
+    # All arguments broadcast: init_pos/init_vel may have shape (N, 3) and
+    # mass, rho, A, drag_coeff shape (N, ) to describe N projectiles at once.
+    def __init__(self, init_pos, init_vel, mass, rho, A, drag_coeff, g=9.82, wind=None):
+        self.init_pos = np.asarray(init_pos, dtype=np.float64)
+        self.init_vel = np.asarray(init_vel, dtype=np.float64)
+        if isinstance(wind, WindField):
+            raise ValueError('The closed-form solution needs a constant wind')
+        if wind is None:
+            wind = np.zeros(3)
+        self.wind = np.asarray(wind, dtype=np.float64)
+        self.g = g
+
+        batch_shape = np.broadcast(self.init_pos[..., 0], self.init_vel[..., 0]).shape
+        if drag_coeff is None:
+            self.scaling = np.zeros(batch_shape)
+        else:
+            scaling = (np.asarray(rho) * np.asarray(drag_coeff) * np.asarray(A)) / \
+                (2 * np.asarray(mass))
+            self.scaling = np.broadcast_to(scaling, batch_shape).astype(np.float64)
+
+        self.u0 = self.init_vel - self.wind
+        self._setup_vertical()
+
+    def _setup_vertical(self):
+        s = self.scaling
+        g = self.g
+        z0 = self.init_pos[..., 2]
+        u0 = self.u0[..., 2]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            drag = s > 0
+            s_safe = np.where(drag, s, 1.0)
+            c = np.sqrt(g * s_safe)  # inverse time constant
+            k = np.sqrt(g / s_safe)  # terminal velocity
+
+            up = np.maximum(u0, 0) / k
+            a = np.arctan(up)
+            t_top = np.where(drag, a / c, np.maximum(u0, 0) / g)
+            z_top = np.where(
+                drag,
+                z0 + 0.5 * np.log1p(np.square(up)) / s_safe,
+                z0 + np.square(np.maximum(u0, 0)) / (2 * g)
+            )
+
+            # Speed at the start of the descent, relative to terminal velocity
+            ratio = np.maximum(-u0, 0) / k
+            below_terminal = ratio <= 1
+            b = np.where(below_terminal, np.arctanh(ratio), np.arctanh(1 / ratio))
+
+        self._s, self._c, self._k = s_safe, c, k
+        self._drag = drag
+        self._up, self._a, self._b = up, a, b
+        self._below_terminal = below_terminal
+        self.t_top, self.z_top = t_top, z_top
+
+    def _vertical(self, t):
+        g = self.g
+        s, c, k = self._s, self._c, self._k
+        z0 = self.init_pos[..., 2]
+        u0 = self.u0[..., 2]
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            # Ascent
+            phase = self._a - c * np.minimum(t, self.t_top)
+            z_up = z0 + (np.log(np.cos(phase)) + 0.5 * np.log1p(np.square(self._up))) / s
+            u_up = k * np.tan(phase)
+
+            # Descent
+            tau = np.maximum(t - self.t_top, 0)
+            arg = self._b + c * tau
+            z_tanh = self.z_top - (_log_cosh(arg) - _log_cosh(self._b)) / s
+            z_coth = self.z_top - (_log_sinh(arg) - _log_sinh(self._b)) / s
+            z_terminal = self.z_top - k * tau
+            z_down = np.where(
+                self._below_terminal,
+                np.where(np.isinf(self._b), z_terminal, z_tanh),
+                z_coth
+            )
+            u_down = np.where(self._below_terminal, -k * np.tanh(arg), -k / np.tanh(arg))
+
+            rising = t < self.t_top
+            z_drag = np.where(rising, z_up, z_down)
+            u_drag = np.where(rising, u_up, u_down)
+
+            # No drag
+            z_free = z0 + u0 * t - 0.5 * g * np.square(t)
+            u_free = u0 - g * t
+
+        z = np.where(self._drag, z_drag, z_free)
+        u = np.where(self._drag, u_drag, u_free)
+        return z, u
+
+    def state(self, t):
+        # Position and velocity at time t, each with shape t.shape + (3, )
+        # (broadcast against the projectile batch shape)
+        t = np.asarray(t, dtype=np.float64)
+        s = self.scaling
+        x, vx = _drift(self.init_pos[..., 0], self.u0[..., 0], self.wind[..., 0], s, t)
+        y, vy = _drift(self.init_pos[..., 1], self.u0[..., 1], self.wind[..., 1], s, t)
+        z_rel, uz = self._vertical(t)
+        z = z_rel + self.wind[..., 2] * t
+        vz = uz + self.wind[..., 2]
+
+        pos = np.stack(np.broadcast_arrays(x, y, z), axis=-1)
+        vel = np.stack(np.broadcast_arrays(vx, vy, vz), axis=-1)
+        return pos, vel
+
+    def get_pos(self, t):
+        return self.state(t)[0]
+
+    def get_vel(self, t):
+        return self.state(t)[1]
+
+    def impact_time(self, ground=0.0):
+        # Time at which the projectile comes down through z = ground. The
+        # descent branch inverts in closed form; a few Newton steps on z(t)
+        # take care of a vertical wind component, which the closed form ignores.
+        g = self.g
+        s, c = self._s, self._c
+        depth = self.z_top - ground
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            lifted = s * depth
+            arg_tanh = np.arccosh(np.exp(lifted + _log_cosh(self._b)))
+            arg_coth = np.arcsinh(np.exp(lifted + _log_sinh(self._b)))
+            arg = np.where(self._below_terminal, arg_tanh, arg_coth)
+            tau = np.where(
+                self._below_terminal & np.isinf(self._b),
+                depth / self._k,
+                (arg - self._b) / c
+            )
+            t_drag = np.where(depth >= 0, self.t_top + tau, np.nan)
+
+            u0 = self.u0[..., 2]
+            discriminant = np.square(u0) + 2 * g * (self.init_pos[..., 2] - ground)
+            t_free = (u0 + np.sqrt(discriminant)) / g
+        t_impact = np.where(self._drag, t_drag, t_free)
+
+        if np.any(self.wind[..., 2] != 0):
+            for _ in range(8):
+                pos, vel = self.state(t_impact)
+                t_impact = t_impact - (pos[..., 2] - ground) / vel[..., 2]
+        return t_impact
+
+    def impact_point(self, ground=0.0):
+        return self.get_pos(self.impact_time(ground))
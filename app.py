@@ -1,7 +1,20 @@
+import functools
+import hmac
+import json
+import os
+import time
+
 import numpy as np
 
-from flask import Flask, jsonify, request
-from problems import Problem1, Problem2, Problem3
+from flask import Flask, Response, abort, g, jsonify, request, stream_with_context
+import draw
+import metrics
+from grading import grade_x, grade_xyz
+from cache import RESULTS, state_key
+from precompute import PRECOMPUTE, Saturated
+from problems import MAX_STEPS, SALVO_SIZE, Problem1, Problem2, Problem3, Problem4, simulate_batch
+from store import make_store
+from tokens import BadToken, dumps_state, loads_state, new_session, valid_session
 
 ANSWERS = {
     'RED': {'Keycode to the RED padlock is': 795},
@@ -18,25 +31,157 @@ PDF_LINKS = {
 
 
 app = Flask(__name__)
+metrics.CACHES.update(results=RESULTS, plots=draw.PLOTS)
 problem1 = Problem1()
 problem2 = Problem2()
 problem3 = Problem3()
+problem4 = Problem4()
+# Single-shot problems, served by the internal endpoints as well
+PROBLEMS = {p.kind: p for p in (problem1, problem2, problem3)}
+
+# Scenario states live in the store, per session and problem. Sessions are
+# issued by the server: a request without a valid session id (in the header
+# or the cookie) starts a new session, whose id comes back in both.
+SESSION_COOKIE = 'scenario-session'
+SESSION_HEADER = 'X-Scenario-Session'
+STORE = make_store()
+
+
+def session_id():
+    session = request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE)
+    if session is None or not valid_session(session):
+        if 'new_session' not in g:
+            g.new_session = new_session()
+        session = g.new_session
+    return session
+
+
+def load_state(problem, session):
+    scenario_state = STORE.get(session, problem.kind)
+    if scenario_state is None:
+        scenario_state = problem.draw()
+        STORE.put(session, problem.kind, scenario_state)
+    return scenario_state
+
+
+def renew_state(problem, session):
+    scenario_state = problem.draw()
+    STORE.put(session, problem.kind, scenario_state)
+    return scenario_state
+
+
+# Alternatively, clients send back the signed token of the scenario they were
+# given. The token carries the whole state, so any worker can grade it; that
+# it is graded only once is up to the claims of the store, which must be
+# shared by those workers (see store.make_store). Either way, grading renews
+# the session's scenario.
+TOKEN_FIELD = 'scenario token'
+
+
+def with_token(problem, scenario_state):
+    resp = dict(scenario_state)
+    resp[TOKEN_FIELD] = dumps_state(problem, scenario_state)
+    return resp
+
+
+def grading_state(problem, content, session):
+    token = content.get(TOKEN_FIELD)
+    if token is not None:
+        return loads_state(problem, token)
+    return load_state(problem, session)
+
+
+def claim_state(problem, scenario_state, session):
+    # Every scenario is graded once, whichever way it was submitted, since
+    # a wrong guess reveals the true point of impact. Claimed only once its
+    # impact point is known, so that a busy server (503) can be retried.
+    if not STORE.claim(state_key(problem.kind, scenario_state)):
+        renew_state(problem, session)
+        raise AlreadyGraded('This scenario has already been graded, fetch a new one')
+
+
+class AlreadyGraded(Exception):
+    pass
+
+
+@app.errorhandler(BadToken)
+def bad_token(e):
+    return jsonify({'error': str(e)}), 400
+
+
+@app.errorhandler(AlreadyGraded)
+def already_graded(e):
+    return jsonify({'error': str(e)}), 409
+
+
+@app.errorhandler(Saturated)
+def saturated(e):
+    return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+
+
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+
+
+@app.after_request
+def count_request(response):
+    endpoint = request.endpoint or 'unknown'
+    metrics.REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    metrics.REQUEST_DURATION.observe(
+        time.perf_counter() - g.start, endpoint=endpoint, method=request.method
+    )
+    return response
+
+
+@app.after_request
+def issue_session(response):
+    if 'new_session' in g:
+        response.set_cookie(SESSION_COOKIE, g.new_session, httponly=True, samesite='Lax')
+        response.headers[SESSION_HEADER] = g.new_session
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# Endpoints that reveal true points of impact for arbitrary scenarios are only
+# served to clients presenting $INTERNAL_API_KEY, and not at all without it
+INTERNAL_API_KEY = os.environ.get('INTERNAL_API_KEY')
+
+
+def internal(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('X-Api-Key', '')
+        if INTERNAL_API_KEY is None or not hmac.compare_digest(key, INTERNAL_API_KEY):
+            abort(404)
+        return view(*args, **kwargs)
+    return wrapper
 
 
 @app.route('/scenario1-656690c0a658fefea3a2033f437bffe8', methods=['GET', 'POST'])
 def scenario1():
     if request.method == 'GET':
         # Get scenario_parameters
-        return jsonify(problem1.scenario_state)
+        return jsonify(with_token(problem1, load_state(problem1, session_id())))
     if request.method == 'POST':
+        phases = metrics.Phases(problem1.kind)
+        session = session_id()
         content = request.json
+        scenario_state = grading_state(problem1, content, session)
         x_guess = content['point of impact (x)']
+        phases.done('parse')
 
-        xyz = problem1.simulate_scenario()
+        xyz = problem1.impact_point(scenario_state)
+        claim_state(problem1, scenario_state, session)
+        phases.done('simulate')
         x_true = xyz[0, -1]
 
-        delta = np.abs(x_guess - x_true)
-        valid_guess = bool(delta < 0.5)
+        delta, valid = grade_x(x_guess, x_true)
+        valid_guess = bool(valid)
 
         resp = {
             "Your point of impact": x_guess,
@@ -50,27 +195,37 @@ def scenario1():
             for k in d.keys():
                 resp[k] = d[k]
         else:
-            resp['The parameters of the scenario have changed!'] = problem1.scenario_state
+            resp['The parameters of the scenario have changed!'] = scenario_state
 
         # Create new scenario_parameters
-        problem1.setup_scenario()
-        return jsonify(resp)
+        new_state = renew_state(problem1, session)
+        phases.done('setup')
+        resp[TOKEN_FIELD] = dumps_state(problem1, new_state)
+        resp = jsonify(resp)
+        phases.done('serialize')
+        return resp
 
 
 @app.route('/scenario2-1884e8509182844979d1864092796467', methods=['GET', 'POST'])
 def scenario2():
     if request.method == 'GET':
         # Get scenario_parameters
-        return jsonify(problem2.scenario_state)
+        return jsonify(with_token(problem2, load_state(problem2, session_id())))
     if request.method == 'POST':
+        phases = metrics.Phases(problem2.kind)
+        session = session_id()
         content = request.json
+        scenario_state = grading_state(problem2, content, session)
         x_guess = content['point of impact (x)']
+        phases.done('parse')
 
-        xyz = problem2.simulate_scenario()
+        xyz = problem2.impact_point(scenario_state)
+        claim_state(problem2, scenario_state, session)
+        phases.done('simulate')
         x_true = xyz[0, -1]
 
-        delta = np.abs(x_guess - x_true)
-        valid_guess = bool(delta < 0.5)
+        delta, valid = grade_x(x_guess, x_true)
+        valid_guess = bool(valid)
 
         resp = {
             "Your point of impact": x_guess,
@@ -79,7 +234,9 @@ def scenario2():
             "Was your answer within the accepted margin???": valid_guess
         }
 
-        problem2.setup_scenario()
+        scenario_state = renew_state(problem2, session)
+        phases.done('setup')
+        resp[TOKEN_FIELD] = dumps_state(problem2, scenario_state)
 
         if valid_guess:
             d = ANSWERS['BLUE']
@@ -88,27 +245,35 @@ def scenario2():
                 resp[k] = d[k]
 
         else:
-            resp['The parameters of the scenario have changed!'] = problem2.scenario_state
+            resp['The parameters of the scenario have changed!'] = scenario_state
 
         # Create new scenario_parameters
-        return jsonify(resp)
+        resp = jsonify(resp)
+        phases.done('serialize')
+        return resp
 
 
 @app.route('/scenario3-36376971dc4d9fb15505d68ac9b042a2', methods=['GET', 'POST'])
 def scenario3():
     if request.method == 'GET':
         # Get scenario_parameters
-        return jsonify(problem3.scenario_state)
+        return jsonify(with_token(problem3, load_state(problem3, session_id())))
     if request.method == 'POST':
+        phases = metrics.Phases(problem3.kind)
+        session = session_id()
         content = request.json
+        scenario_state = grading_state(problem3, content, session)
         poi_guess = content['point of impact (xyz)']
+        phases.done('parse')
 
-        xyz = problem3.simulate_scenario()
+        xyz = problem3.impact_point(scenario_state)
+        claim_state(problem3, scenario_state, session)
+        phases.done('simulate')
         poi_true = xyz[:, -1]
         poi_true[2] = 0  # Set z to zero
 
-        distance = np.linalg.norm(poi_guess - poi_true, 2)
-        valid_guess = bool(distance < 1)
+        distance, valid = grade_xyz(poi_guess, poi_true)
+        valid_guess = bool(valid)
 
         resp = {
             "Your point of impact (xyz)": poi_guess,
@@ -117,17 +282,185 @@ def scenario3():
             "Was your answer within the accepted margin???": valid_guess
         }
 
-        problem3.setup_scenario()
+        scenario_state = renew_state(problem3, session)
+        phases.done('setup')
+        resp[TOKEN_FIELD] = dumps_state(problem3, scenario_state)
 
         if valid_guess:
             d = ANSWERS['BLACK']
             for k in d.keys():
                 resp[k] = d[k]
         else:
-            resp['The parameters of the scenario have changed!'] = problem3.scenario_state
+            resp['The parameters of the scenario have changed!'] = scenario_state
 
         # Create new scenario_parameters
-        return jsonify(resp)
+        resp = jsonify(resp)
+        phases.done('serialize')
+        return resp
+
+
+def attempt_state(problem, content):
+    # Scenario of an internal request: {"scenario": {...}} or {"scenario token": "..."}
+    # (ValueError for values outside the ranges scenarios are drawn from)
+    if TOKEN_FIELD in content:
+        return loads_state(problem, content[TOKEN_FIELD])
+    scenario = content['scenario']
+    scenario_state = {k: float(scenario[k]) for k in problem.state_keys}
+    problem.check_state(scenario_state)
+    return scenario_state
+
+
+@app.route('/scenario4-5446d488b7b200d91e2e8c112866c400', methods=['GET', 'POST'])
+def scenario4():
+    if request.method == 'GET':
+        # Get scenario_parameters
+        return jsonify(with_token(problem4, load_state(problem4, session_id())))
+    if request.method == 'POST':
+        phases = metrics.Phases(problem4.kind)
+        session = session_id()
+        content = request.json
+        scenario_state = grading_state(problem4, content, session)
+        try:
+            poi_guess = np.array(content['points of impact (xyz)'], dtype=np.float64)
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({'error': f'Malformed guess: {e!r}'}), 400
+        if poi_guess.shape != (SALVO_SIZE, 3):
+            return jsonify({'error': f'Guess one xyz point for each of the {SALVO_SIZE} '
+                                     'projectiles, in order'}), 400
+        phases.done('parse')
+
+        xyz = problem4.impact_point(scenario_state)
+        claim_state(problem4, scenario_state, session)
+        phases.done('simulate')
+        poi_true = xyz.T
+        poi_true[:, 2] = 0  # Set z to zero
+
+        # Every projectile must be within the problem3 margin
+        distance, valid = grade_xyz(poi_guess, poi_true)
+        valid_guess = bool(valid.all())
+
+        resp = {
+            "Your points of impact (xyz)": poi_guess.tolist(),
+            "True points of impact (xyz)": poi_true.tolist(),
+            "Distances (euclidean) between your guesses and the true points of impact":
+                distance.tolist(),
+            "Was your answer within the accepted margin???": valid_guess
+        }
+
+        scenario_state = renew_state(problem4, session)
+        phases.done('setup')
+        resp[TOKEN_FIELD] = dumps_state(problem4, scenario_state)
+
+        if not valid_guess:
+            resp['The parameters of the scenario have changed!'] = scenario_state
+
+        resp = jsonify(resp)
+        phases.done('serialize')
+        return resp
+
+
+MAX_BATCH = 10000
+
+
+@app.route('/grade-batch/<kind>', methods=['POST'])
+@internal
+def grade_batch(kind):
+    # Grades many {"scenario": {...} or "scenario token": "...", "guess": ...}
+    # attempts in one pass and answers with one column per field
+    problem = PROBLEMS.get(kind)
+    if problem is None:
+        abort(404)
+
+    content = request.get_json()
+    attempts = content.get('attempts') if isinstance(content, dict) else None
+    if not isinstance(attempts, list) or not 0 < len(attempts) <= MAX_BATCH:
+        return jsonify({'error': f'attempts must be a list of 1 to {MAX_BATCH} items'}), 400
+
+    try:
+        scenario_states = [attempt_state(problem, attempt) for attempt in attempts]
+        guesses = np.array([attempt['guess'] for attempt in attempts], dtype=np.float64)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Malformed attempt: {e!r}'}), 400
+    if kind == 'problem3' and guesses.shape != (len(attempts), 3):
+        return jsonify({'error': 'Each guess must be an xyz point'}), 400
+    if kind != 'problem3' and guesses.shape != (len(attempts), ):
+        return jsonify({'error': 'Each guess must be an x coordinate'}), 400
+
+    try:
+        poi_true = simulate_batch(problem, scenario_states, executor=PRECOMPUTE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if kind == 'problem3':
+        poi_true[:, 2] = 0  # Set z to zero
+        distance, valid = grade_xyz(guesses, poi_true)
+        resp = {
+            'True point of impact (xyz)': poi_true.tolist(),
+            'Distance (euqlidian) between your guess and the true point of impact':
+                distance.tolist(),
+        }
+    else:
+        delta, valid = grade_x(guesses, poi_true[:, 0])
+        resp = {
+            'True point of impact': poi_true[:, 0].tolist(),
+            'delta': delta.tolist(),
+        }
+    resp['Was your answer within the accepted margin???'] = valid.tolist()
+    return jsonify(resp)
+
+
+@app.route('/plot/<kind>', methods=['POST'])
+@internal
+def plot(kind):
+    # Trajectory plot of one scenario, ?format=png (default) or svg. Plots are
+    # rendered by the PRECOMPUTE workers and cached by scenario.
+    problem = PROBLEMS.get(kind)
+    fmt = request.args.get('format', 'png')
+    if problem is None or fmt not in draw.FORMATS:
+        abort(404)
+
+    try:
+        scenario_state = attempt_state(problem, request.json)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Malformed scenario: {e!r}'}), 400
+
+    key = f'{fmt}:{state_key(kind, scenario_state)}'
+    image = draw.PLOTS.get(key)
+    if image is None:
+        image = PRECOMPUTE.result(key, draw.render, kind, scenario_state, fmt)
+        draw.PLOTS.put(key, image)
+    return Response(image, content_type=draw.FORMATS[fmt])
+
+
+@app.route('/trajectory/<kind>', methods=['POST'])
+@internal
+def trajectory(kind):
+    # Streams {"t", "x", "y", "z"} samples of one scenario as NDJSON while it
+    # is integrated, every ?stride=N steps (default 100); the last line is the
+    # point of impact
+    problem = PROBLEMS.get(kind)
+    if problem is None:
+        abort(404)
+
+    try:
+        scenario_state = attempt_state(problem, request.json)
+        stride = int(request.args.get('stride', 100))
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Malformed request: {e!r}'}), 400
+    steps = problem.predict_steps(scenario_state)
+    if MAX_STEPS and steps > MAX_STEPS:
+        return jsonify({'error': f'Scenarios may take at most {MAX_STEPS} steps'}), 400
+    if not 1 <= stride <= max(steps, 1):
+        return jsonify({'error': f'stride must be between 1 and {max(steps, 1)}, '
+                                 'the steps this scenario takes'}), 400
+
+    scenario = problem.scenario(scenario_state, record_stride=stride)
+    samples = scenario.shoot(*problem.shot(scenario_state), record='stream')
+
+    def lines():
+        for t, x, y, z in samples:
+            yield json.dumps({'t': t, 'x': x, 'y': y, 'z': z}) + '\n'
+    return Response(stream_with_context(lines()), content_type='application/x-ndjson')
 
 
 @app.route('/', methods=['GET'])
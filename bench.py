@@ -0,0 +1,186 @@
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from cache import RESULTS
+from problems import Problem1, Problem2, Problem3, simulate_batch
+
+PROBLEMS = {p.kind: p for p in (Problem1, Problem2, Problem3)}
+
+# Benchmarked engines and the Problem.simulate settings they run with
+ENGINES = {
+    'euler': dict(record='impact'),
+    'euler-full': dict(record='full'),
+    'rk45': dict(record='impact', engine='rk45'),
+    'analytic': dict(record='impact', engine='analytic'),
+    'batch': None,  # problems.simulate_batch over all scenarios at once
+}
+
+PERCENTILES = (50, 90, 99, 100)
+
+
+def draw_states(problem, n, seed):
+    # Reproducible scenario parameters drawn the way the server draws them
+    np.random.seed(seed)
+    instance = problem()
+    return [instance.new_state() for _ in range(n)]
+
+
+def run(problem, scenario_state, record='impact', **kwargs):
+    scenario = problem.scenario(scenario_state, **kwargs)
+    scenario.shoot(*problem.shot(scenario_state), record=record)
+    return scenario
+
+
+def bench_engine(problem, states, engine, memory):
+    if ENGINES[engine] is None:
+        RESULTS.clear()
+        t0 = time.perf_counter()
+        simulate_batch(problem, states)
+        wall = time.perf_counter() - t0
+        RESULTS.clear()
+
+        tracemalloc.start()
+        simulate_batch(problem, states[:memory])
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        RESULTS.clear()
+        # One pass over all scenarios has no per-scenario latency: only its
+        # throughput is reported
+        return {
+            'wall [s]': wall,
+            'scenarios/s': len(states) / wall,
+            'steps': None,
+            'latency [ms]': None,
+            'peak memory [MB]': peak / 2**20,
+        }
+
+    settings = ENGINES[engine]
+    times = []
+    steps = 0
+    for scenario_state in states:
+        t0 = time.perf_counter()
+        scenario = run(problem, scenario_state, **settings)
+        times.append(time.perf_counter() - t0)
+        steps += scenario.n_steps
+
+    # Memory is traced in a separate pass, tracing slows the loops down a lot
+    peak = 0
+    for scenario_state in states[:memory]:
+        tracemalloc.start()
+        run(problem, scenario_state, **settings)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    wall = sum(times)
+    return {
+        'wall [s]': wall,
+        'scenarios/s': len(states) / wall,
+        'steps': steps,
+        'steps/s': steps / wall if steps else None,
+        'latency [ms]': {f'p{q}': 1e3 * np.percentile(times, q) for q in PERCENTILES},
+        'peak memory [MB]': peak / 2**20,
+    }
+
+
+def bench_http(n, seed):
+    # GET/POST cycles through the Flask test client, one session per cycle:
+    # each GET starts a new one, which its POST sends back.
+    # Every scenario is drawn on demand, as with SCENARIO_POOL_SIZE=0: pool
+    # refills would compete with the requests measured.
+    import app
+    for problem in (app.problem1, app.problem2, app.problem3):
+        problem.pool = None
+
+    np.random.seed(seed)
+    client = app.app.test_client(use_cookies=False)
+    rules = {rule.endpoint: rule.rule for rule in app.app.url_map.iter_rules()}
+    results = {}
+    for kind, endpoint in [('problem1', 'scenario1'), ('problem2', 'scenario2'),
+                           ('problem3', 'scenario3')]:
+        guess = {'point of impact (xyz)': [0, 0, 0]} if kind == 'problem3' else \
+            {'point of impact (x)': 0}
+        get_times, post_times = [], []
+        failed = {}
+        t_start = time.perf_counter()
+        for i in range(n):
+            t0 = time.perf_counter()
+            get = client.get(rules[endpoint])
+            t1 = time.perf_counter()
+            headers = {app.SESSION_HEADER: get.headers.get(app.SESSION_HEADER, '')}
+            post = client.post(rules[endpoint], json=guess, headers=headers)
+            t2 = time.perf_counter()
+            get_times.append(t1 - t0)
+            post_times.append(t2 - t1)
+            for resp in (get, post):
+                if resp.status_code != 200:
+                    failed[resp.status_code] = failed.get(resp.status_code, 0) + 1
+        wall = time.perf_counter() - t_start
+
+        # Failed requests (e.g. a quick 503) are timed too, the bench fails
+        # rather than report them as throughput
+        results[kind] = {
+            'failed': failed,
+            'req/s': 2 * n / wall,
+            'GET [ms]': {f'p{q}': 1e3 * np.percentile(get_times, q) for q in PERCENTILES},
+            'POST [ms]': {f'p{q}': 1e3 * np.percentile(post_times, q) for q in PERCENTILES},
+        }
+    return results
+
+
+def fmt(value, spec='.3g'):
+    return '-' if value is None else format(value, spec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark simulation engines and routes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenarios', type=int, default=20, help='scenarios per problem')
+    parser.add_argument('--problems', default=','.join(PROBLEMS))
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--memory', type=int, default=3,
+                        help='scenarios per engine traced for peak memory')
+    parser.add_argument('--http', type=int, default=0, help='GET/POST cycles per route')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = {'seed': args.seed, 'scenarios': args.scenarios, 'engines': {}}
+    print(f'{"problem":10} {"engine":11} {"wall [s]":>9} {"scen/s":>9} {"steps/s":>9} '
+          f'{"p50 [ms]":>9} {"p99 [ms]":>9} {"max [ms]":>9} {"peak [MB]":>9}')
+    for i, kind in enumerate(args.problems.split(',')):
+        problem = PROBLEMS[kind]
+        states = draw_states(problem, args.scenarios, args.seed + i)
+        for engine in args.engines.split(','):
+            r = bench_engine(problem, states, engine, args.memory)
+            results['engines'].setdefault(kind, {})[engine] = r
+            latency = r['latency [ms]'] or {}
+            print(f'{kind:10} {engine:11} {r["wall [s]"]:9.3f} {r["scenarios/s"]:9.3g} '
+                  f'{fmt(r.get("steps/s")):>9} {fmt(latency.get("p50"), ".2f"):>9} '
+                  f'{fmt(latency.get("p99"), ".2f"):>9} {fmt(latency.get("p100"), ".2f"):>9} '
+                  f'{r["peak memory [MB]"]:9.3f}')
+
+    if args.http:
+        results['http'] = bench_http(args.http, args.seed)
+        print()
+        print(f'{"route":10} {"req/s":>9} {"GET p50":>9} {"GET p99":>9} '
+              f'{"POST p50":>9} {"POST p99":>9} {"failed":>9}')
+        for kind, r in results['http'].items():
+            print(f'{kind:10} {r["req/s"]:9.1f} {r["GET [ms]"]["p50"]:9.2f} '
+                  f'{r["GET [ms]"]["p99"]:9.2f} {r["POST [ms]"]["p50"]:9.2f} '
+                  f'{r["POST [ms]"]["p99"]:9.2f} {sum(r["failed"].values()):9d}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failed = {kind: r['failed'] for kind, r in results.get('http', {}).items() if r['failed']}
+    if failed:
+        sys.exit(f'Failed requests, by status: {failed}')
+
+
+if __name__ == '__main__':
+    main()
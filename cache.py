@@ -0,0 +1,92 @@
+import hashlib
+import json
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def state_key(kind, scenario_state):
+    # Canonical, hashable key for a scenario: insertion order of the state and
+    # the NumPy scalar types of its values do not matter
+    canonical = json.dumps(
+        scenario_state,
+        sort_keys=True,
+        separators=(',', ':'),
+        default=lambda o: o.tolist()
+    )
+    digest = hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+    return f'{kind}:{digest}'
+
+
+def _sizeof(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+class LRUCache():
+    # Thread-safe LRU cache bounded both by number of entries and by the
+    # (approximate) number of bytes held
+    def __init__(self, maxsize=4096, max_bytes=16 * 2**20):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.nbytes += size
+
+            while len(self.entries) > self.maxsize or self.nbytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.nbytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.nbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+RESULTS = LRUCache()
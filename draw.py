@@ -1,24 +1,39 @@
-"""
+import io
+
 import numpy as np
 import matplotlib
-# matplotlib.use('TkAgg')
+matplotlib.use('Agg')
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from cache import LRUCache
+from problems import PROBLEM_CLASSES
 
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
+# Rendered trajectories keep at most this many points (see
+# TrajectoryRecorder); the raw Euler path has one every 1e-4 s
+MAX_POINTS = 2000
 
-from projectile import Projectile
+FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# Rendered plots, by format and scenario key
+PLOTS = LRUCache(maxsize=256, max_bytes=32 * 2**20)
 
 
 class Draw():
+    # Launcher, impact and trajectory views of shot scenarios. Scenarios may
+    # carry a target and tolerance to mark in the impact view.
     def __init__(self, scenarios):
         self.scenarios = scenarios
 
-    def __call__(self):
-        fig = plt.figure(constrained_layout=True, figsize=(12, 8))
+    def __call__(self, fmt='png'):
+        # Headless: a bare Figure on an Agg canvas, no pyplot state
+        fig = Figure(constrained_layout=True, figsize=(12, 8))
+        FigureCanvasAgg(fig)
         gs = fig.add_gridspec(2, 4)
         # Launcher view
         ax = fig.add_subplot(gs[0, 0:2])
-        for angle_in_deg in map(lambda x: x.angle_in_deg, self.scenarios):
+        for angle_in_deg in map(launch_angle, self.scenarios):
             rads = np.deg2rad(angle_in_deg)
             x = np.cos(rads)
             z = np.sin(rads)
@@ -38,11 +53,14 @@ class Draw():
 
         # Impact view
         ax = fig.add_subplot(gs[0, 2:4])
-        for xyz, target, tolerance in map(lambda x: (x.xyz, x.target, x.tolerance), self.scenarios):
+        for scenario in self.scenarios:
+            ax.plot(scenario.xyz[0, -1], 0, 'bx', zorder=5)
 
-            ax.plot(xyz[0, -1], 0, 'bx', zorder=5)
-            ax.plot(target, 0, 'go', zorder=10)
-            ax.plot([target - tolerance, target + tolerance], [0, 0], 'g-|', zorder=15)
+            target = getattr(scenario, 'target', None)
+            if target is not None:
+                tolerance = scenario.tolerance
+                ax.plot(target, 0, 'go', zorder=10)
+                ax.plot([target - tolerance, target + tolerance], [0, 0], 'g-|', zorder=15)
 
         xlim_min, xlim_max = ax.get_xlim()
         ax.plot([xlim_min, xlim_max], [0, 0], color=(0.7,) * 4, zorder=0)
@@ -53,11 +71,29 @@ class Draw():
 
         # Trajectory view
         ax = fig.add_subplot(gs[1, :])
-        for xyz, target, tolerance in map(lambda x: (x.xyz, x.target, x.tolerance), self.scenarios):
+        for xyz in map(lambda x: x.xyz, self.scenarios):
             ax.plot(xyz[0, :], xyz[2, :], ':k')
 
         ax.set_aspect('equal')
         ax.set_xlabel('x')
         ax.set_ylabel('z')
-        plt.show()
-"""
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt)
+        return buffer.getvalue()
+
+
+def launch_angle(scenario):
+    # Elevation of the shot: angle_in_deg in 2D, theta_in_deg in 3D
+    if hasattr(scenario, 'angle_in_deg'):
+        return scenario.angle_in_deg
+    return scenario.theta_in_deg
+
+
+def render(kind, scenario_state, fmt='png'):
+    # Plot of one scenario, from a decimated trajectory. Module level, so
+    # that PRECOMPUTE workers can run it.
+    problem = PROBLEM_CLASSES[kind]
+    scenario = problem.scenario(scenario_state, max_points=MAX_POINTS)
+    scenario.shoot(*problem.shot(scenario_state), record='full')
+    return Draw([scenario])(fmt)
@@ -0,0 +1,16 @@
+import numpy as np
+
+# Acceptance rules, shared by the scenario routes, the batch endpoint and the
+# engine regression harness
+MARGIN_X = 0.5
+MARGIN_XYZ = 1
+
+
+def grade_x(x_guess, x_true):
+    delta = np.abs(x_guess - x_true)
+    return delta, delta < MARGIN_X
+
+
+def grade_xyz(poi_guess, poi_true):
+    distance = np.linalg.norm(poi_guess - poi_true, 2, axis=-1)
+    return distance, distance < MARGIN_XYZ
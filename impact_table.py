@@ -0,0 +1,282 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from analytic import AnalyticProjectile
+
+AXES = ('log drag scaling', 'vertical launch speed [m/s]')
+
+# Drag acts on each axis separately, so the vertical motion, and with it the
+# time of impact, only depends on the drag scaling s = rho * drag_coeff * A /
+# (2 * mass) and the vertical launch speed. The table covers PARAMS: radius
+# 0.01-0.2 m, mass 0.05-1 kg, speed 100-1000 m/s at 15-175 deg.
+BOUNDS = (
+    (np.log(8e-5), np.log(0.8)),
+    (5, 1000),
+)
+SHAPE = (512, 2048)
+
+# Interpolation error bounds are the worst error seen around a cell, times this
+SAFETY = 4
+
+
+def drag_scaling(mass, rho, A, drag_coeff):
+    return rho * drag_coeff * A / (2 * mass)
+
+
+# The Euler loop of Projectile.advance differs from the exact solution by a
+# first-order term. Explicit Euler on v' = f(v) follows v' = f - dt/2 f' f to
+# first order, which in 1-D moves v(t) by -dt/2 f(v) log(f(v) / f(v0)). The
+# position update with the new velocity adds dt/2 (v1 - v0). The terms below
+# are per unit dt.
+
+def _horizontal_term(u0, u1):
+    # f = -s u|u| in the wind frame, u from u0 to u1 (same sign)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(u0 != 0, u1 / u0, 1)
+        return -(u1 * np.log(ratio) - u1 + u0) + 0.5 * (u1 - u0)
+
+
+def _vertical_term(s, vz0, vz1, g):
+    # f = -s v|v| - g, rising from vz0 > 0 and falling to vz1 < 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k = np.sqrt(g / s)
+        rise = vz0 * np.log(s * vz0 * vz0 + g) - 2 * vz0 + 2 * k * np.arctan(vz0 / k)
+        fall = vz1 * np.log(g - s * vz1 * vz1) - 2 * vz1 + 2 * k * np.arctanh(vz1 / k)
+        integral = fall - rise - np.log(s * vz0 * vz0 + g) * (vz1 - vz0)
+    return -0.5 * integral + 0.5 * (vz1 - vz0)
+
+
+def vertical_solution(s, vz0, g=9.82):
+    # Exact impact time and vertical impact speed, and the vertical Euler
+    # term, of projectiles launched from z = 0 without vertical wind
+    s, vz0 = np.broadcast_arrays(np.asarray(s, np.float64), np.asarray(vz0, np.float64))
+    init_vel = np.stack([np.zeros_like(s), np.zeros_like(s), vz0], -1)
+    projectile = AnalyticProjectile(
+        init_pos=np.zeros(3),
+        init_vel=init_vel,
+        mass=1,
+        rho=2 * s,
+        A=1,
+        drag_coeff=1,
+        g=g
+    )
+    t = projectile.impact_time()
+    vz1 = projectile.get_vel(t)[..., 2]
+    return t, vz1, _vertical_term(s, vz0, vz1, g)
+
+
+def impact_x(s, vx0, wind, t, vz1, dz, dt, z_stop=0.0001):
+    # Impact x reported by the Euler loop at time step dt, from the vertical
+    # solution: the horizontal drift is closed-form given the time of impact.
+    # Also returns the x velocity at impact and the Euler term c (per unit dt).
+    u0 = vx0 - wind
+    spread = s * np.abs(u0) * t
+    x = wind * t + np.sign(u0) * np.log1p(spread) / s
+    u1 = u0 / (1 + spread)
+    vx1 = wind + u1
+
+    # A higher z at the exact impact time means a later, further impact, and
+    # stopping on the first step below ground lands dt/2 past it on average
+    c = _horizontal_term(u0, u1) - vx1 / vz1 * dz + 0.5 * vx1
+    # The loop stops below z_stop rather than 0, slightly before impact
+    return x + c * dt + vx1 / vz1 * z_stop, vx1, c
+
+
+def _catmull_rom(t):
+    # Weights of the grid points i-1, i, i+1, i+2 at fraction t past point i
+    t2 = t * t
+    t3 = t2 * t
+    return np.stack([
+        (-t3 + 2 * t2 - t) / 2,
+        (3 * t3 - 5 * t2 + 2) / 2,
+        (-3 * t3 + 4 * t2 + t) / 2,
+        (t3 - t2) / 2,
+    ], axis=-1)
+
+
+class ImpactTable():
+    # Impact points of the 2D problems without integrating. The vertical
+    # solution (time of impact, vertical impact speed and Euler term) is
+    # tabulated over a regular (log drag scaling, vertical launch speed)
+    # grid with a per-cell error bound, and interpolated with bicubic
+    # Catmull-Rom splines. The rest is closed-form (see impact_x) and
+    # reproduces the Euler integration of Scenario2D at any small dt.
+    #
+    # Every array is a .npy file opened memory-mapped, so worker processes
+    # share one copy of the table through the page cache.
+    FIELDS = ('t', 'vz', 'dz')
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'axes.json')) as f:
+            axes = json.load(f)
+        self.start = np.array(axes['start'])
+        self.step = np.array(axes['step'])
+        self.shape = tuple(axes['shape'])
+        self.g = axes['g']
+
+        self.fields = {}
+        for name in self.FIELDS:
+            for prefix in ('', 'err_'):
+                self.fields[prefix + name] = np.load(
+                    os.path.join(path, f'{prefix}{name}.npy'), mmap_mode='r'
+                )
+
+    def _interpolate(self, names, points):
+        # points: (N, 2) in axis units. Returns the interpolated fields and
+        # the cell of every point, (N, 2), with -1 for points off the grid.
+        shape = np.array(self.shape)
+        u = (points - self.start) / self.step
+        inside = np.all((u >= 0) & (u <= shape - 1), axis=1)
+        cell = np.clip(np.floor(np.nan_to_num(u)).astype(np.intp), 0, shape - 2)
+        weights = _catmull_rom(u - cell)
+
+        offsets = np.arange(-1, 3)
+        rows = np.clip(cell[:, 0:1] + offsets, 0, shape[0] - 1)
+        cols = np.clip(cell[:, 1:2] + offsets, 0, shape[1] - 1)
+        values = []
+        for name in names:
+            patch = self.fields[name][rows[:, :, None], cols[:, None, :]]
+            values.append(np.einsum('ni,nij,nj->n', weights[:, 0], patch, weights[:, 1]))
+
+        cell[~inside] = -1
+        return values, cell
+
+    def lookup(self, s, angle, speed, wind, dt):
+        # Impact x that Scenario2D reports at time step dt, and a bound on the
+        # error of that value (inf off the grid). Arguments broadcast.
+        s, angle, speed, wind, dt = np.broadcast_arrays(
+            *(np.asarray(a, dtype=np.float64) for a in (s, angle, speed, wind, dt))
+        )
+        rads = np.deg2rad(angle)
+        vx0 = np.cos(rads) * speed
+        vz0 = np.sin(rads) * speed
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            points = np.stack([np.log(s), vz0], axis=-1).reshape(-1, 2)
+        (t, vz1, dz), cell = self._interpolate(self.FIELDS, points)
+        t, vz1, dz = (a.reshape(s.shape) for a in (t, vz1, dz))
+        x, vx1, c = impact_x(s, vx0, wind, t, vz1, dz, dt)
+
+        # First-order propagation of the interpolation errors, plus the
+        # jitter of the Euler stop (up to dt/2 either side of its mean) and
+        # the higher-order Euler terms, which stay below 1% of c dt
+        inside = (cell[:, 0] >= 0).reshape(s.shape)
+        ci = tuple(np.where(cell[:, d] >= 0, cell[:, d], 0).reshape(s.shape) for d in range(2))
+        err_t, err_vz, err_dz = (self.fields['err_' + name][ci] for name in self.FIELDS)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = np.abs(vx1 / vz1)
+            bound = (
+                np.abs(vx1) * err_t
+                + dt * slope * (err_dz + np.abs(dz / vz1) * err_vz)
+                + 0.5 * dt * np.abs(vx1)
+                + 0.01 * dt * np.abs(c)
+            )
+        return x, np.where(inside & np.isfinite(bound), bound, np.inf)
+
+    @classmethod
+    def build(cls, path, shape=SHAPE, bounds=BOUNDS, g=9.82):
+        # Tabulates the grid points, then bounds the interpolation error of
+        # every cell by the spline's error at the cell centre, taking the
+        # worst of each cell and its neighbours, times SAFETY
+        os.makedirs(path, exist_ok=True)
+        start = np.array([lo for lo, _ in bounds], dtype=np.float64)
+        stop = np.array([hi for _, hi in bounds], dtype=np.float64)
+        step = (stop - start) / (np.array(shape) - 1)
+
+        grid = start + np.stack(np.indices(shape), axis=-1) * step
+        nodes = vertical_solution(np.exp(grid[..., 0]), grid[..., 1], g)
+        for name, values in zip(cls.FIELDS, nodes):
+            np.save(os.path.join(path, f'{name}.npy'), values)
+        with open(os.path.join(path, 'axes.json'), 'w') as f:
+            json.dump({
+                'axes': AXES,
+                'start': start.tolist(),
+                'step': step.tolist(),
+                'shape': list(shape),
+                'g': g,
+            }, f, indent=2)
+
+        cells = tuple(n - 1 for n in shape)
+        table = cls.__new__(cls)
+        table.start, table.step, table.shape, table.g = start, step, tuple(shape), g
+        table.fields = dict(zip(cls.FIELDS, nodes))
+
+        centres = start + (np.stack(np.indices(cells), axis=-1) + 0.5) * step
+        exact = vertical_solution(np.exp(centres[..., 0]), centres[..., 1], g)
+        interpolated, _ = table._interpolate(cls.FIELDS, centres.reshape(-1, 2))
+        for name, e, i in zip(cls.FIELDS, exact, interpolated):
+            err = np.abs(i.reshape(cells) - e)
+            err[~np.isfinite(err)] = np.inf
+            err = (SAFETY * _dilate(err)).astype(np.float32)
+            np.save(os.path.join(path, f'err_{name}.npy'), err)
+
+
+def _dilate(err):
+    # Maximum over each cell and its neighbours along every axis
+    out = err.copy()
+    for axis in range(err.ndim):
+        src = out.copy()
+        lo = [slice(None)] * err.ndim
+        hi = [slice(None)] * err.ndim
+        lo[axis], hi[axis] = slice(None, -1), slice(1, None)
+        np.maximum(out[tuple(lo)], src[tuple(hi)], out=out[tuple(lo)])
+        np.maximum(out[tuple(hi)], src[tuple(lo)], out=out[tuple(hi)])
+    return out
+
+
+def load_table(path):
+    # The table at path, or None if there is none
+    if not path or not os.path.exists(os.path.join(path, 'axes.json')):
+        return None
+    return ImpactTable(path)
+
+
+def check(path, count, seed):
+    # Compares table lookups with Scenario2D simulations of random scenarios
+    from problems import PROBLEM_CLASSES
+
+    table = ImpactTable(path)
+    rng = np.random.default_rng(seed)
+    for kind in ('problem1', 'problem2'):
+        problem = PROBLEM_CLASSES[kind]
+        states = problem().sample_states(rng, count)
+
+        errors, bounds = [], []
+        for scenario_state in states:
+            scenario = problem.scenario(scenario_state)
+            angle, speed = problem.shot(scenario_state)
+            s = drag_scaling(scenario.mass, scenario.rho, scenario.A, scenario.drag_coeff)
+            x, bound = table.lookup(s, angle, speed, scenario.wind[0], scenario.dt)
+            x_true = problem.simulate(scenario_state)[0, -1]
+            errors.append(abs(x - x_true))
+            bounds.append(bound)
+
+        errors, bounds = np.array(errors), np.array(bounds)
+        print(f'{kind}: {len(states)} scenarios, max error {errors.max():.4f} m, '
+              f'median bound {np.median(bounds):.4f} m, '
+              f'{np.count_nonzero(errors > bounds)} outside their bound')
+        for tolerance in (0.005, 0.01, 0.02, 0.05):
+            print(f'  bound <= {tolerance} m: {np.mean(bounds <= tolerance):6.1%}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or check the 2D impact point table')
+    parser.add_argument('command', choices=('build', 'check'))
+    parser.add_argument('path', help='directory holding the table')
+    parser.add_argument('--shape', default=','.join(map(str, SHAPE)),
+                        help='grid points along ' + ', '.join(AXES))
+    parser.add_argument('--count', type=int, default=100, help='scenarios to check')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        ImpactTable.build(args.path, shape=tuple(int(n) for n in args.shape.split(',')))
+    else:
+        check(args.path, args.count, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import numpy as np
+from scipy.integrate import solve_ivp
+
+from wind import WindField
+
+
+def solve_rk45(projectile, wind=None, rtol=1e-9, atol=1e-6, t_max=1e4, ground=0.0):
+    # Adaptive Runge-Kutta (Dormand-Prince) integration of a Projectile until
+    # it comes down through z = ground, which is located exactly by an event
+    def rhs(t, y):
+        w = wind(y[2], t) if isinstance(wind, WindField) else wind
+        return np.concatenate([y[3:], projectile.acceleration(y[3:], w)])
+
+    def hit_ground(t, y):
+        return y[2] - ground
+    hit_ground.terminal = True
+    hit_ground.direction = -1
+
+    y0 = np.concatenate([projectile.get_current_pos(), projectile.get_current_vel()])
+    sol = solve_ivp(
+        rhs,
+        (0, t_max),
+        y0,
+        method='RK45',
+        events=hit_ground,
+        rtol=rtol,
+        atol=atol,
+        dense_output=True
+    )
+    if not sol.t_events[0].size:
+        raise RuntimeError(f'Projectile did not land within {t_max} s: {sol.message}')
+    return sol
@@ -0,0 +1,251 @@
+import argparse
+import http.client
+import json
+import os
+import queue
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+LOCAL_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+PERCENTILES = (50, 95, 99)
+
+# Guesses sent on POST, the answer does not matter for load
+GUESSES = {
+    'problem1': {'point of impact (x)': 0},
+    'problem2': {'point of impact (x)': 0},
+    'problem3': {'point of impact (xyz)': [0, 0, 0]},
+    'problem4': {'points of impact (xyz)': [[0, 0, 0]] * int(os.environ.get('SALVO_SIZE', 4))},
+}
+
+
+def scenario_routes(path='app.py'):
+    # The /scenarioN-<hex> paths, read from app.py rather than importing the
+    # app (and drawing scenarios) in the load generator
+    with open(path) as f:
+        routes = re.findall(r"@app\.route\('(/scenario(\d)-[0-9a-f]+)'", f.read())
+    return {f'problem{n}': route for route, n in routes}
+
+
+def synthesize(routes, kinds, n_sessions, cycles):
+    # GET/POST cycles, one session per simulated user
+    log = []
+    for c in range(cycles):
+        for s in range(n_sessions):
+            for kind in kinds:
+                session = f'load-{s}'
+                log.append({'method': 'GET', 'path': routes[kind], 'session': session})
+                log.append({'method': 'POST', 'path': routes[kind], 'session': session,
+                            'json': GUESSES[kind]})
+    return log
+
+
+def read_log(path, routes):
+    # One JSON request per line: {"method", "path", "session", "json"}. The path
+    # may also name a problem ("problem2"), which maps to its route
+    log = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entry['path'] = routes.get(entry['path'], entry['path'])
+                log.append(entry)
+    return log
+
+
+class Worker(threading.Thread):
+    # Sends the requests of its own queue, in order, over one keep-alive
+    # connection. The sessions of the log are mapped to the session ids the
+    # server issues on their first request.
+    def __init__(self, url, jobs, results, timeout):
+        super().__init__(daemon=True)
+        self.url = url
+        self.jobs = jobs
+        self.results = results
+        self.timeout = timeout
+        self.sessions = {}
+
+    def connect(self):
+        return http.client.HTTPConnection(self.url.hostname, self.url.port or 80,
+                                          timeout=self.timeout)
+
+    def run(self):
+        conn = self.connect()
+        while True:
+            try:
+                entry = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+
+            session = entry.get('session', 'default')
+            headers = {}
+            if session in self.sessions:
+                headers['X-Scenario-Session'] = self.sessions[session]
+            body = None
+            if 'json' in entry:
+                body = json.dumps(entry['json'])
+                headers['Content-Type'] = 'application/json'
+
+            t0 = time.perf_counter()
+            try:
+                conn.request(entry['method'], entry['path'], body=body, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                status = resp.status
+                issued = resp.getheader('X-Scenario-Session')
+                if issued is not None:
+                    self.sessions[session] = issued
+            except (OSError, http.client.HTTPException) as e:
+                status = type(e).__name__
+                conn.close()
+                conn = self.connect()
+            self.results.append((entry['method'], status, time.perf_counter() - t0))
+        conn.close()
+
+
+def run_load(url, log, concurrency, timeout):
+    # All requests of a session go to the same worker, in log order, so that
+    # its GET/POST cycles are replayed as they were made
+    queues = [queue.Queue() for _ in range(concurrency)]
+    assigned = {}
+    for entry in log:
+        session = entry.get('session', 'default')
+        if session not in assigned:
+            assigned[session] = len(assigned) % concurrency
+        queues[assigned[session]].put(entry)
+    results = []
+
+    workers = [Worker(url, jobs, results, timeout) for jobs in queues]
+    t0 = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results, time.perf_counter() - t0
+
+
+def summarize(results, wall):
+    summary = {'requests': len(results), 'wall [s]': wall, 'req/s': len(results) / wall}
+    for method in ('GET', 'POST', 'all'):
+        rows = [r for r in results if method in ('all', r[0])]
+        if not rows:
+            continue
+        latency = np.array([r[2] for r in rows])
+        errors = [r[1] for r in rows if not (isinstance(r[1], int) and r[1] < 400)]
+        codes = {}
+        for r in rows:
+            codes[str(r[1])] = codes.get(str(r[1]), 0) + 1
+        summary[method] = {
+            'requests': len(rows),
+            'error rate': len(errors) / len(rows),
+            'status': codes,
+            'latency [ms]': {f'p{q}': 1e3 * np.percentile(latency, q) for q in PERCENTILES},
+        }
+    return summary
+
+
+def procfile_command(env, path='Procfile'):
+    # The web command of the Procfile, with ${VAR:-default} expanded from env
+    with open(path) as f:
+        command = next(line for line in f if line.startswith('web:'))[len('web:'):]
+    command = re.sub(r'\$\{(\w+):-([^}]*)\}', lambda m: env.get(m[1], m[2]), command)
+    return shlex.split(command)
+
+
+def start_gunicorn(url, workers):
+    # Local server on the port of the target url, run as the Procfile runs it
+    # (WEB_THREADS threads per worker), stopped again after the run. Several
+    # workers need a store and a key they share; temporary ones unless
+    # configured.
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers))
+    if workers > 1 and 'SCENARIO_STORE' not in env:
+        env['SCENARIO_STORE'] = f'sqlite:{tempfile.mkdtemp()}/scenarios.sqlite'
+    if workers > 1 and 'SCENARIO_SECRET_KEY' not in env:
+        env['SCENARIO_SECRET_KEY'] = os.urandom(32).hex()
+    command = procfile_command(env)
+    if command[0] == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn'] + command[1:]
+    proc = subprocess.Popen(command + ['-b', f'{url.hostname}:{url.port}'], env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(url.hostname, url.port, timeout=1)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError('gunicorn exited during startup')
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError('gunicorn did not start listening within 30 s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the scenario routes on localhost')
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--replay', help='request log to replay (JSON lines)')
+    parser.add_argument('--problems', default=','.join(GUESSES))
+    parser.add_argument('--sessions', type=int, default=8,
+                        help='simulated users when synthesizing requests')
+    parser.add_argument('--cycles', type=int, default=5,
+                        help='GET/POST cycles per user and problem when synthesizing')
+    parser.add_argument('--record', help='write the request log used to this file')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--spawn', type=int, metavar='WORKERS',
+                        help='start gunicorn as in the Procfile, with this many workers')
+    parser.add_argument('--json', help='also write the summary to this file')
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    if url.hostname not in LOCAL_HOSTS:
+        parser.error('only local servers may be load tested')
+
+    routes = scenario_routes()
+    if args.replay:
+        log = read_log(args.replay, routes)
+    else:
+        log = synthesize(routes, args.problems.split(','), args.sessions, args.cycles)
+
+    if args.record:
+        with open(args.record, 'w') as f:
+            for entry in log:
+                f.write(json.dumps(entry) + '\n')
+
+    server = start_gunicorn(url, args.spawn) if args.spawn else None
+    try:
+        results, wall = run_load(url, log, args.concurrency, args.timeout)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    summary = summarize(results, wall)
+    summary['concurrency'] = args.concurrency
+    print(f'{summary["requests"]} requests in {wall:.2f} s, {summary["req/s"]:.1f} req/s '
+          f'at concurrency {args.concurrency}')
+    print(f'{"method":6} {"count":>6} {"errors":>7} {"p50 [ms]":>9} {"p95 [ms]":>9} '
+          f'{"p99 [ms]":>9}  status')
+    for method in ('GET', 'POST', 'all'):
+        if method in summary:
+            s = summary[method]
+            latency = s['latency [ms]']
+            print(f'{method:6} {s["requests"]:6} {s["error rate"]:7.1%} {latency["p50"]:9.1f} '
+                  f'{latency["p95"]:9.1f} {latency["p99"]:9.1f}  {s["status"]}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
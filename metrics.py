@@ -0,0 +1,243 @@
+import bisect
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+               for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Counter():
+    # Monotonic count per label combination
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[k] for k in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for key, value in values.items():
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram():
+    # Observations per label combination, counted into fixed buckets. Only
+    # bucket counts, their sum and count are kept, so observing is O(log buckets).
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets)) + (float('inf'), )
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[k] for k in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts[0][i] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def samples(self):
+        with self.lock:
+            values = {key: (list(c[0]), c[1], c[2]) for key, c in self.values.items()}
+        for key, (counts, total, n) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_format_value(total)}'
+            yield f'{self.name}_count{labels} {n}'
+
+
+class Observed():
+    # Values per label combination kept elsewhere (e.g. by an LRUCache), as
+    # read() returns them whenever the metrics are rendered
+    def __init__(self, name, help, kind, read, labelnames=()):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.read = read
+        self.labelnames = labelnames
+
+    def samples(self):
+        for key, value in self.read().items():
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Registry():
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, buckets, labelnames=()):
+        metric = Histogram(name, help, buckets, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def observed(self, name, help, kind, read, labelnames=()):
+        metric = Observed(name, help, kind, read, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+SECONDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+SIMULATIONS = REGISTRY.counter(
+    'scenario_simulations_total', 'Simulations run', ('problem', 'engine', 'record')
+)
+SIMULATION_STEPS = REGISTRY.histogram(
+    'scenario_simulation_steps', 'Integration steps per simulation',
+    (1e2, 1e3, 1e4, 3e4, 1e5, 3e5, 1e6, 3e6, 1e7), ('problem', 'engine')
+)
+SIMULATION_FLIGHT_TIME = REGISTRY.histogram(
+    'scenario_simulation_flight_time_seconds', 'Simulated flight time until impact',
+    (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200), ('problem', )
+)
+SIMULATION_WALL_TIME = REGISTRY.histogram(
+    'scenario_simulation_wall_seconds', 'Wall time spent simulating',
+    SECONDS, ('problem', 'engine')
+)
+TRAJECTORY_BYTES = REGISTRY.histogram(
+    'scenario_trajectory_bytes', 'Memory held by recorded full trajectories',
+    (1e3, 1e4, 1e5, 1e6, 1e7, 1e8), ('problem', )
+)
+PREDICTED_STEPS = REGISTRY.histogram(
+    'scenario_predicted_steps', 'Predicted integration steps of drawn scenarios',
+    (1e4, 3e4, 1e5, 2e5, 3e5, 5e5, 1e6, 3e6), ('problem', )
+)
+REDRAWS = REGISTRY.counter(
+    'scenario_redraws_total', 'Drawn scenarios rejected for exceeding the step budget',
+    ('problem', )
+)
+TABLE_LOOKUPS = REGISTRY.counter(
+    'scenario_table_lookups_total', 'Impact table lookups, by whether they were precise enough',
+    ('problem', 'result')
+)
+
+# LRUCaches by name, registered by the app; their stats() are exported below
+CACHES = {}
+
+
+def _cache_stat(stat):
+    def read():
+        return {(name, ): cache.stats()[stat] for name, cache in list(CACHES.items())}
+    return read
+
+
+CACHE_HITS = REGISTRY.observed(
+    'scenario_cache_hits_total', 'Cache lookups that found their entry', 'counter',
+    _cache_stat('hits'), ('cache', )
+)
+CACHE_MISSES = REGISTRY.observed(
+    'scenario_cache_misses_total', 'Cache lookups that did not', 'counter',
+    _cache_stat('misses'), ('cache', )
+)
+CACHE_EVICTIONS = REGISTRY.observed(
+    'scenario_cache_evictions_total', 'Entries evicted to keep caches within bounds', 'counter',
+    _cache_stat('evictions'), ('cache', )
+)
+CACHE_ENTRIES = REGISTRY.observed(
+    'scenario_cache_entries', 'Entries held per cache', 'gauge',
+    _cache_stat('entries'), ('cache', )
+)
+CACHE_BYTES = REGISTRY.observed(
+    'scenario_cache_bytes', 'Approximate memory held per cache', 'gauge',
+    _cache_stat('bytes'), ('cache', )
+)
+REQUEST_PHASE = REGISTRY.histogram(
+    'scenario_request_phase_seconds', 'Wall time per phase of a grading request',
+    SECONDS, ('problem', 'phase')
+)
+REQUESTS = REGISTRY.counter(
+    'http_requests_total', 'Requests served', ('endpoint', 'method', 'status')
+)
+REQUEST_DURATION = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Wall time per request',
+    SECONDS, ('endpoint', 'method')
+)
+
+
+def simulation_stats(scenario, record, wall):
+    # Plain dict, so that it can be sent back from a worker process
+    stats = {
+        'engine': scenario.engine,
+        'record': record,
+        'n_steps': scenario.n_steps,
+        'flight_time': scenario.flight_time,
+        'wall': wall,
+    }
+    if record == 'full':
+        stats['trajectory_bytes'] = scenario.xyz.nbytes + scenario.t.nbytes
+    return stats
+
+
+def observe_simulation(kind, stats):
+    engine = stats['engine']
+    SIMULATIONS.inc(problem=kind, engine=engine, record=stats['record'])
+    if stats['n_steps']:
+        # Closed-form engines take no steps
+        SIMULATION_STEPS.observe(stats['n_steps'], problem=kind, engine=engine)
+    SIMULATION_FLIGHT_TIME.observe(stats['flight_time'], problem=kind)
+    SIMULATION_WALL_TIME.observe(stats['wall'], problem=kind, engine=engine)
+    if 'trajectory_bytes' in stats:
+        TRAJECTORY_BYTES.observe(stats['trajectory_bytes'], problem=kind)
+
+
+class Phases():
+    # Times consecutive phases of a request: done(phase) records the time
+    # since the previous call (or since creation)
+    def __init__(self, kind):
+        self.kind = kind
+        self.last = time.perf_counter()
+
+    def done(self, phase):
+        now = time.perf_counter()
+        REQUEST_PHASE.observe(now - self.last, problem=self.kind, phase=phase)
+        self.last = now
@@ -45,6 +45,24 @@ class Parameters():
 
         return mass, radius, wind_vel, wind_angle, proj_vel, proj_angle, proj_angle_2
 
+    def sample(self, rng, n):
+        # n draws of everything new() draws, as arrays, from a np.random.Generator
+        def uni(lb, ub):
+            return np.round(rng.uniform(lb, ub, n), 2)
+
+        mass = uni(self.mass_lb, self.mass_ub)
+        radius = uni(self.radius_lb, self.radius_ub)
+
+        wind_vel = uni(self.wind_vel_lb, self.wind_vel_ub)
+        wind_angle = uni(0, 360)
+
+        proj_vel = uni(self.proj_vel_lb, self.proj_vel_ub)
+        proj_angle = uni(15, 175)
+
+        proj_angle_2 = uni(15, 175)
+
+        return mass, radius, wind_vel, wind_angle, proj_vel, proj_angle, proj_angle_2
+
     @staticmethod
     def polar_to_carth(mag, angle):
         rads = np.deg2rad(angle)
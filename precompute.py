@@ -0,0 +1,148 @@
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+
+def in_pool_worker():
+    # True in worker processes, which import the app again when spawned (the
+    # main module is re-run); they must not start pools of their own
+    return multiprocessing.current_process().name != 'MainProcess'
+
+
+def lower_priority(increment):
+    # Worker initializer: the OS runs these workers only when others are idle
+    os.nice(increment)
+
+
+class Saturated(Exception):
+    # The pool cannot take (or finish) the work in time; retry later
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Precompute():
+    # Runs simulations in a pool of worker processes, so that they never hold
+    # the GIL of the request threads. Simulations start in the background as
+    # soon as a scenario is drawn. Futures are keyed by scenario, so that
+    # whoever grades the scenario later only has to collect the (usually
+    # finished) result.
+    #
+    # At most max_queued simulations are queued or running at a time.
+    # Background submissions beyond that are dropped, and result() raises
+    # Saturated, as it does when a result takes longer than timeout seconds.
+    #
+    # Workers run at the given niceness, so that background work (see REFILL)
+    # only takes the CPU time that grading leaves over.
+    def __init__(self, max_workers=None, max_queued=None, max_pending=64, timeout=30, nice=0):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queued = max_queued or 4 * self.max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.nice = nice
+
+        # Created on first use, i.e. in the process (e.g. gunicorn worker)
+        # serving requests rather than in one that merely imports this module
+        self.executor = None
+        self.queued = 0
+        self.pending = OrderedDict()
+        self.lock = threading.RLock()  # done callbacks may run in _submit
+
+    def _submit(self, fn, *args):
+        # Called with the lock held
+        if self.queued >= self.max_queued:
+            raise Saturated(f'{self.queued} simulations queued, try again shortly')
+        if self.executor is None:
+            # Spawned rather than forked: forking a multi-threaded server is unsafe
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=lower_priority if self.nice else None,
+                initargs=(self.nice, ) if self.nice else ()
+            )
+        try:
+            future = self.executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self.executor = None
+            raise Saturated('Simulation worker failed, try again')
+        self.queued += 1
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self.lock:
+            self.queued -= 1
+
+    def submit(self, key, fn, *args):
+        if in_pool_worker():
+            return None
+
+        with self.lock:
+            future = self.pending.get(key)
+            if future is None:
+                try:
+                    future = self._submit(fn, *args)
+                except Saturated:
+                    # Computed on demand by result() instead
+                    return None
+                self.pending[key] = future
+
+            # Scenarios that are never graded must not pile up
+            while len(self.pending) > self.max_pending:
+                _, oldest = self.pending.popitem(last=False)
+                oldest.cancel()
+        return future
+
+    def start(self, fn, *args):
+        # Unkeyed job (e.g. a batch of scenarios); raises Saturated when full
+        with self.lock:
+            return self._submit(fn, *args)
+
+    def result(self, key, fn, *args):
+        # Waits for the precomputed result, or submits it now if the scenario
+        # was never submitted (or has been evicted)
+        with self.lock:
+            future = self.pending.pop(key, None)
+            if future is None or future.cancelled():
+                future = self._submit(fn, *args)
+        return self.wait(future, key)
+
+    def run(self, fn, *args):
+        # Unkeyed job, waited for; raises Saturated like result()
+        return self.wait(self.start(fn, *args))
+
+    def wait(self, future, key=None):
+        # Result of a future from this pool; raises Saturated
+        try:
+            return future.result(timeout=self.timeout)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool
+            with self.lock:
+                if self.executor is not None and self.executor._broken:
+                    self.executor = None
+            raise Saturated('Simulation worker failed, try again')
+        except TimeoutError:
+            # Put back, so that a retry collects the same simulation
+            if key is not None:
+                with self.lock:
+                    self.pending[key] = future
+            raise Saturated(f'Simulation did not finish within {self.timeout} s')
+
+
+PRECOMPUTE = Precompute(
+    max_workers=int(os.environ.get('SIMULATION_WORKERS', 0)),
+    max_queued=int(os.environ.get('SIMULATION_QUEUE', 0)),
+    timeout=float(os.environ.get('SIMULATION_TIMEOUT', 30))
+)
+
+# Refills of the scenario pools run on workers of their own, at low priority:
+# they can neither take queue slots from grading requests nor hold up their
+# simulations
+REFILL = Precompute(
+    max_workers=int(os.environ.get('SCENARIO_POOL_WORKERS', 1)),
+    timeout=float(os.environ.get('SIMULATION_TIMEOUT', 30)),
+    nice=int(os.environ.get('SCENARIO_POOL_NICE', 10))
+)
@@ -1,8 +1,19 @@
+import os
+import time
+
 import numpy as np
 
+import metrics
 from scenario2D import Scenario2D
 from scenario3D import Scenario3D
+from salvo import Salvo
 from parameters import Parameters
+from projectile import BatchProjectile
+from analytic import AnalyticProjectile
+from precompute import PRECOMPUTE, REFILL
+from scenario_pool import ScenarioPool
+from impact_table import drag_scaling, load_table
+from cache import RESULTS, state_key
 
 PARAMS = Parameters(
     mass_lb=0.05,
@@ -17,47 +28,248 @@ PARAMS = Parameters(
 
 DELTA_T = 0.0001
 
+# Worst-case server work per scenario: draws predicted to take more Euler
+# steps than this are redrawn (0 disables the budget). The default only
+# cuts the slowest ~2% of draws, the longest flights.
+MAX_STEPS = int(os.environ.get('SCENARIO_MAX_STEPS', 500000))
+MAX_REDRAWS = 20
+
+# Ready-to-serve scenarios kept per problem (0 disables the pools). Seeding
+# makes the scenarios reproducible, and therefore predictable: testing only.
+POOL_SIZE = int(os.environ.get('SCENARIO_POOL_SIZE', 64))
+POOL_SEED = os.environ.get('SCENARIO_POOL_SEED')
+
+# Optional table of 2D impact points, built with `python impact_table.py
+# build <path>`. Its answers are used, without integrating, when they are
+# within IMPACT_TABLE_TOLERANCE metres of what the simulation would give.
+IMPACT_TABLE = load_table(os.environ.get('IMPACT_TABLE'))
+IMPACT_TABLE_TOLERANCE = float(os.environ.get('IMPACT_TABLE_TOLERANCE', 0.01))
+
+# Projectiles per problem4 salvo. Changing it invalidates issued tokens.
+SALVO_SIZE = int(os.environ.get('SALVO_SIZE', 4))
+
+# Ranges that Parameters draws each state value from, which scenarios sent
+# in by clients must keep to as well (see Problem.check_state)
+STATE_RANGES = {
+    'projectile mass [kg]': (PARAMS.mass_lb, PARAMS.mass_ub),
+    'projectile radius [m]': (PARAMS.radius_lb, PARAMS.radius_ub),
+    'wind speed [m/s]': (PARAMS.wind_vel_lb, PARAMS.wind_vel_ub),
+    'wind (x) [m/s]': (-PARAMS.wind_vel_ub, PARAMS.wind_vel_ub),
+    'wind direction [deg]': (0, 360),
+    'projectile angle [deg]': (15, 175),
+    'projectile theta angle [deg]': (15, 175),
+    'projectile phi angle [deg]': (15, 175),
+    'projectile speed [m/s]': (PARAMS.proj_vel_lb, PARAMS.proj_vel_ub),
+    'delta T (used when simulating server-side)': (DELTA_T, DELTA_T),
+}
+
+
+class Problem():
+    # Shared plumbing: the impact point of a freshly drawn scenario is
+    # computed in the background, in the PRECOMPUTE process pool, and
+    # impact_point collects it. Impact points are memoized in RESULTS, keyed
+    # on problem kind and state.
+    kind = None
+    state_keys = ()
+    tabulated = False  # covered by IMPACT_TABLE
 
-class Problem1():
-    # Point of impact for a 2D projectile with drag but no wind
     def __init__(self):
         self.params = PARAMS
-        self.scenario_state = self.setup_scenario()
+        self.pool = None
+        if POOL_SIZE:
+            seed = None if POOL_SEED is None else int(POOL_SEED)
+            self.pool = ScenarioPool(self, size=POOL_SIZE, seed=seed)
+        # Drawn on first use: the app keeps its scenarios per session instead
+        self.scenario_state = None
+
+    def draw(self):
+        # New scenario state within the step budget: from the pool, where
+        # its impact point is known already, or drawn now with its impact
+        # point on the way when the pool has run dry
+        if self.pool is not None:
+            scenario_state = self.pool.pop()
+            if scenario_state is not None:
+                return scenario_state
+
+        for _ in range(MAX_REDRAWS):
+            scenario_state = self.new_state()
+            steps = self.predict_steps(scenario_state)
+            if not MAX_STEPS or steps <= MAX_STEPS:
+                break
+            metrics.REDRAWS.inc(problem=self.kind)
+        else:
+            # Only likely with a budget that rejects most draws
+            raise RuntimeError(
+                f'No {self.kind} scenario within {MAX_STEPS} steps in {MAX_REDRAWS} draws'
+            )
+        metrics.PREDICTED_STEPS.observe(steps, problem=self.kind)
+
+        key = state_key(self.kind, scenario_state)
+        if key not in RESULTS and self.table_point(scenario_state) is None:
+            PRECOMPUTE.submit(key, run_simulation, self.kind, scenario_state)
+        return scenario_state
+
+    def new_state(self):
+        return self.make_state(*self.params.new())
+
+    def sample_states(self, rng, n):
+        # Up to n scenario states within the step budget, sampled and
+        # screened in one vectorized pass
+        scenario_states = self._sample(rng, n)
+        steps = self.predict_steps_many(scenario_states)
+        for s in steps:
+            metrics.PREDICTED_STEPS.observe(s, problem=self.kind)
+        if not MAX_STEPS:
+            return scenario_states
+
+        within = steps <= MAX_STEPS
+        metrics.REDRAWS.inc(int(np.count_nonzero(~within)), problem=self.kind)
+        return [s for s, ok in zip(scenario_states, within) if ok]
+
+    def _sample(self, rng, n):
+        return [self.make_state(*p) for p in zip(*self.params.sample(rng, n))]
+
+    def solve_states(self, scenario_states, chunk_size=8):
+        # Impact points of scenario_states, computed by the REFILL workers
+        # in small chunks and stored in RESULTS. Raises Saturated.
+        chunks = [
+            scenario_states[i:i + chunk_size]
+            for i in range(0, len(scenario_states), chunk_size)
+        ]
+        for i in range(0, len(chunks), REFILL.max_workers):
+            wave = chunks[i:i + REFILL.max_workers]
+            futures = [REFILL.start(simulate_states, self.kind, chunk) for chunk in wave]
+            for chunk, future in zip(wave, futures):
+                for scenario_state, (xyz, stats) in zip(chunk, REFILL.wait(future)):
+                    metrics.observe_simulation(self.kind, stats)
+                    RESULTS.put(state_key(self.kind, scenario_state), xyz)
+
+    def impact_point(self, scenario_state):
+        # Raises precompute.Saturated if the pool is too busy
+        key = state_key(self.kind, scenario_state)
+        xyz = RESULTS.get(key)
+        if xyz is None:
+            xyz = self.table_point(scenario_state)
+        if xyz is None:
+            xyz, stats = PRECOMPUTE.result(key, run_simulation, self.kind, scenario_state)
+            metrics.observe_simulation(self.kind, stats)
+            RESULTS.put(key, xyz)
+        # Callers may modify the result, the cached array must stay intact
+        return xyz.copy()
+
+    def table_point(self, scenario_state):
+        # Impact point from IMPACT_TABLE, or None if the table's error bound
+        # for this scenario is over IMPACT_TABLE_TOLERANCE
+        if IMPACT_TABLE is None or not self.tabulated:
+            return None
+        scenario = self.scenario(scenario_state)
+        angle, speed = self.shot(scenario_state)
+        x, bound = IMPACT_TABLE.lookup(
+            drag_scaling(scenario.mass, scenario.rho, scenario.A, scenario.drag_coeff),
+            angle, speed, scenario.wind[0], scenario.dt
+        )
+        hit = bound <= IMPACT_TABLE_TOLERANCE
+        metrics.TABLE_LOOKUPS.inc(problem=self.kind, result='hit' if hit else 'miss')
+        if not hit:
+            return None
+        return np.array([[float(x)], [0.0], [0.0]])
 
     def setup_scenario(self):
-        mass, radius, wind_vel, wind_angle, proj_vel, proj_angle, _ = self.params.new()
-        self.scenario_state = {
+        self.scenario_state = self.draw()
+        return self.scenario_state
+
+    def simulate_scenario(self, record='impact'):
+        if self.scenario_state is None:
+            self.setup_scenario()
+        if record != 'impact':
+            return self.simulate(self.scenario_state, record=record)
+        return self.impact_point(self.scenario_state)
+
+    @classmethod
+    def check_state(cls, scenario_state):
+        # ValueError unless every value is within its STATE_RANGES (NaN is not)
+        for key in cls.state_keys:
+            lb, ub = STATE_RANGES[key]
+            if not lb <= scenario_state[key] <= ub:
+                raise ValueError(f'{key} must be within [{lb}, {ub}]')
+
+    @classmethod
+    def predict_steps(cls, scenario_state):
+        # Euler steps the scenario takes, from its exact flight time. Vertical
+        # motion does not depend on the (horizontal) wind, so this costs
+        # well under a millisecond whatever the scenario.
+        scenario = cls.scenario(scenario_state, engine='analytic')
+        scenario.shoot(*cls.shot(scenario_state), record='impact')
+        return int(np.ceil(scenario.flight_time / scenario.dt))
+
+    @classmethod
+    def predict_steps_many(cls, scenario_states):
+        return predict_steps_batch(cls, scenario_states)
+
+    @classmethod
+    def simulate(cls, scenario_state, record='impact', **kwargs):
+        # Simulates in this process. kwargs (dt, engine, ...) override the
+        # Scenario settings of the problem
+        xyz, stats = run_simulation(cls.kind, scenario_state, record, **kwargs)
+        metrics.observe_simulation(cls.kind, stats)
+        return xyz
+
+
+class Problem1(Problem):
+    # Point of impact for a 2D projectile with drag but no wind
+    kind = 'problem1'
+    tabulated = True
+    state_keys = (
+        'projectile mass [kg]',
+        'projectile radius [m]',
+        'projectile angle [deg]',
+        'projectile speed [m/s]',
+        'delta T (used when simulating server-side)',
+    )
+
+    def make_state(self, mass, radius, wind_vel, wind_angle, proj_vel, proj_angle, _):
+        scenario_state = {
             'projectile mass [kg]': mass,
             'projectile radius [m]': radius,
             'projectile angle [deg]': proj_angle,
             'projectile speed [m/s]': proj_vel,
             'delta T (used when simulating server-side)': DELTA_T,
         }
-        return self.scenario_state
+        return scenario_state
 
-    def simulate_scenario(self):
-        scenario = Scenario2D(
-            dt=0.0001,
-            mass=self.scenario_state["projectile mass [kg]"],
-            r=self.scenario_state["projectile radius [m]"],
-            wind=np.zeros(3)
+    @staticmethod
+    def scenario(scenario_state, dt=0.0001, **kwargs):
+        return Scenario2D(
+            dt=dt,
+            mass=scenario_state["projectile mass [kg]"],
+            r=scenario_state["projectile radius [m]"],
+            wind=np.zeros(3),
+            **kwargs
         )
-        xyz = scenario.shoot(
-            self.scenario_state['projectile angle [deg]'],
-            self.scenario_state["projectile speed [m/s]"]
+
+    @staticmethod
+    def shot(scenario_state):
+        return (
+            scenario_state['projectile angle [deg]'],
+            scenario_state["projectile speed [m/s]"]
         )
-        return xyz
 
 
-class Problem2():
+class Problem2(Problem):
     # 2D. Wind in x direction, but with drag as well
-    def __init__(self):
-        self.params = PARAMS
-        self.scenario_state = self.setup_scenario()
+    kind = 'problem2'
+    tabulated = True
+    state_keys = (
+        'projectile mass [kg]',
+        'projectile radius [m]',
+        'wind (x) [m/s]',
+        'projectile angle [deg]',
+        'projectile speed [m/s]',
+        'delta T (used when simulating server-side)',
+    )
 
-    def setup_scenario(self):
-        mass, radius, wind_vel, wind_angle, proj_vel, proj_angle, _ = self.params.new()
-        self.scenario_state = {
+    def make_state(self, mass, radius, wind_vel, wind_angle, proj_vel, proj_angle, _):
+        scenario_state = {
             'projectile mass [kg]': mass,
             'projectile radius [m]': radius,
             'wind (x) [m/s]': np.round(self.params.polar_to_carth(wind_vel, wind_angle)[0], 2),
@@ -65,34 +277,46 @@ class Problem2():
             'projectile speed [m/s]': proj_vel,
             'delta T (used when simulating server-side)': DELTA_T,
         }
-        return self.scenario_state
+        return scenario_state
 
-    def simulate_scenario(self):
-        scenario = Scenario2D(
-            dt=DELTA_T,
-            mass=self.scenario_state["projectile mass [kg]"],
-            r=self.scenario_state["projectile radius [m]"],
+    @staticmethod
+    def scenario(scenario_state, dt=DELTA_T, **kwargs):
+        return Scenario2D(
+            dt=dt,
+            mass=scenario_state["projectile mass [kg]"],
+            r=scenario_state["projectile radius [m]"],
             wind=np.array([
-                self.scenario_state['wind (x) [m/s]'],
+                scenario_state['wind (x) [m/s]'],
                 0,
                 0
-            ])
+            ]),
+            **kwargs
         )
-        xyz = scenario.shoot(
-            self.scenario_state['projectile angle [deg]'],
-            self.scenario_state["projectile speed [m/s]"]
+
+    @staticmethod
+    def shot(scenario_state):
+        return (
+            scenario_state['projectile angle [deg]'],
+            scenario_state["projectile speed [m/s]"]
         )
-        return xyz
 
 
-class Problem3():
-    def __init__(self):
-        self.params = PARAMS
-        self.scenario_state = self.setup_scenario()
+class Problem3(Problem):
+    kind = 'problem3'
+    state_keys = (
+        'projectile mass [kg]',
+        'projectile radius [m]',
+        'wind speed [m/s]',
+        'wind direction [deg]',
+        'projectile theta angle [deg]',
+        'projectile phi angle [deg]',
+        'projectile speed [m/s]',
+        'delta T (used when simulating server-side)',
+    )
 
-    def setup_scenario(self):
-        mass, radius, wind_vel, wind_angle, proj_vel, proj_angle, proj_angle_2 = self.params.new()
-        self.scenario_state = {
+    def make_state(self, mass, radius, wind_vel, wind_angle, proj_vel, proj_angle,
+                   proj_angle_2):
+        scenario_state = {
             'projectile mass [kg]': mass,
             'projectile radius [m]': radius,
             'wind speed [m/s]': wind_vel,
@@ -102,25 +326,200 @@ class Problem3():
             'projectile speed [m/s]': proj_vel,
             'delta T (used when simulating server-side)': DELTA_T,
         }
-        return self.scenario_state
-
-    def simulate_scenario(self):
-        wind_vel = self.scenario_state['wind speed [m/s]']
-        wind_dir = self.scenario_state['wind direction [deg]']
-        wind = self.params.polar_to_carth(wind_vel, wind_dir)
+        return scenario_state
 
-        phi_in_deg = self.scenario_state['projectile phi angle [deg]']
-        theta_in_deg = self.scenario_state['projectile theta angle [deg]']
+    @staticmethod
+    def scenario(scenario_state, dt=0.0001, **kwargs):
+        wind_vel = scenario_state['wind speed [m/s]']
+        wind_dir = scenario_state['wind direction [deg]']
+        wind = Parameters.polar_to_carth(wind_vel, wind_dir)
 
-        scenario = Scenario3D(
-            dt=0.0001,
-            mass=self.scenario_state["projectile mass [kg]"],
-            r=self.scenario_state["projectile radius [m]"],
-            wind=wind
+        return Scenario3D(
+            dt=dt,
+            mass=scenario_state["projectile mass [kg]"],
+            r=scenario_state["projectile radius [m]"],
+            wind=wind,
+            **kwargs
         )
-        xyz = scenario.shoot(
-            phi_in_deg,
-            theta_in_deg,
-            self.scenario_state["projectile speed [m/s]"]
+
+    @staticmethod
+    def shot(scenario_state):
+        return (
+            scenario_state['projectile phi angle [deg]'],
+            scenario_state['projectile theta angle [deg]'],
+            scenario_state["projectile speed [m/s]"]
         )
-        return xyz
+
+
+SALVO_KEYS = (
+    'projectile mass [kg]',
+    'projectile radius [m]',
+    'projectile theta angle [deg]',
+    'projectile phi angle [deg]',
+    'projectile speed [m/s]',
+)
+
+
+def salvo_key(i, key):
+    # 'projectile mass [kg]' of the i-th projectile (from 1) of a salvo
+    return key.replace('projectile', f'projectile {i}', 1)
+
+
+class Problem4(Problem):
+    # A salvo of SALVO_SIZE projectiles, each drawn like the problem3 one,
+    # under one shared wind. All of them are computed in one vectorized pass
+    # (see Salvo) and graded together; impact points are the columns of xyz.
+    kind = 'problem4'
+    state_keys = tuple(
+        salvo_key(i, key) for i in range(1, SALVO_SIZE + 1) for key in SALVO_KEYS
+    ) + (
+        'wind speed [m/s]',
+        'wind direction [deg]',
+        'delta T (used when simulating server-side)',
+    )
+
+    def make_state(self, mass, radius, wind_vel, wind_angle, proj_vel, proj_angle,
+                   proj_angle_2):
+        # One value per projectile in each argument; the first wind is shared
+        scenario_state = {}
+        for i, values in enumerate(zip(mass, radius, proj_angle, proj_angle_2, proj_vel), 1):
+            for key, value in zip(SALVO_KEYS, values):
+                scenario_state[salvo_key(i, key)] = value
+        scenario_state['wind speed [m/s]'] = wind_vel[0]
+        scenario_state['wind direction [deg]'] = wind_angle[0]
+        scenario_state['delta T (used when simulating server-side)'] = DELTA_T
+        return scenario_state
+
+    def new_state(self):
+        return self.make_state(*zip(*(self.params.new() for _ in range(SALVO_SIZE))))
+
+    def _sample(self, rng, n):
+        draws = (d.reshape(n, SALVO_SIZE) for d in self.params.sample(rng, n * SALVO_SIZE))
+        return [self.make_state(*p) for p in zip(*draws)]
+
+    @staticmethod
+    def salvo(scenario_state):
+        # The projectiles as problem3 scenario states
+        shared = {k: scenario_state[k] for k in Problem4.state_keys[-3:]}
+        return [
+            dict(shared, **{key: scenario_state[salvo_key(i, key)] for key in SALVO_KEYS})
+            for i in range(1, SALVO_SIZE + 1)
+        ]
+
+    @classmethod
+    def check_state(cls, scenario_state):
+        for s in cls.salvo(scenario_state):
+            Problem3.check_state(s)
+
+    @classmethod
+    def predict_steps_many(cls, scenario_states):
+        # A salvo takes as many steps as its longest flight
+        if not scenario_states:
+            return np.zeros(0, dtype=np.int64)
+        shots = [s for scenario_state in scenario_states for s in cls.salvo(scenario_state)]
+        steps = predict_steps_batch(Problem3, shots)
+        return steps.reshape(len(scenario_states), SALVO_SIZE).max(axis=1)
+
+    @staticmethod
+    def scenario(scenario_state, dt=DELTA_T, engine='euler', **kwargs):
+        # engine is one of salvo.ENGINES
+        return Salvo([
+            Problem3.scenario(s, dt=dt, **kwargs) for s in Problem4.salvo(scenario_state)
+        ], engine=engine)
+
+    @staticmethod
+    def shot(scenario_state):
+        return [Problem3.shot(s) for s in Problem4.salvo(scenario_state)]
+
+
+PROBLEM_CLASSES = {p.kind: p for p in (Problem1, Problem2, Problem3, Problem4)}
+
+
+def run_simulation(kind, scenario_state, record='impact', **kwargs):
+    # Module level, so that worker processes can unpickle it. Returns the
+    # xyz and the metrics.simulation_stats of the run; observing them is up
+    # to the caller, whose process serves the metrics.
+    problem = PROBLEM_CLASSES[kind]
+    t0 = time.perf_counter()
+    scenario = problem.scenario(scenario_state, **kwargs)
+    xyz = scenario.shoot(*problem.shot(scenario_state), record=record)
+    return xyz, metrics.simulation_stats(scenario, record, time.perf_counter() - t0)
+
+
+def simulate_states(kind, scenario_states):
+    # run_simulation of many scenarios in one round trip to a worker process
+    return [run_simulation(kind, scenario_state) for scenario_state in scenario_states]
+
+
+def _batch_arrays(problem, scenario_states):
+    # Per-scenario arrays, stacked along the first axis, of the Scenarios
+    # the problem builds for scenario_states
+    scenarios = [problem.scenario(s) for s in scenario_states]
+    init_vel = [sc.initial_velocity(*problem.shot(s)) for sc, s in zip(scenarios, scenario_states)]
+    arrays = {
+        'init_pos': np.array([sc.init_pos for sc in scenarios]),
+        'init_vel': np.array(init_vel),
+        'mass': np.array([sc.mass for sc in scenarios]),
+        'rho': np.array([sc.rho for sc in scenarios]),
+        'A': np.array([sc.A for sc in scenarios]),
+        'drag_coeff': np.array([sc.drag_coeff for sc in scenarios]),
+        'wind': np.array([sc.wind for sc in scenarios], dtype=np.float64),
+    }
+    return scenarios, arrays
+
+
+def predict_steps_batch(problem, scenario_states):
+    # Problem.predict_steps of many scenarios at once
+    if not scenario_states:
+        return np.zeros(0, dtype=np.int64)
+    scenarios, arrays = _batch_arrays(problem, scenario_states)
+    flight_time = AnalyticProjectile(**arrays).impact_time()
+    return np.ceil(flight_time / scenarios[0].dt).astype(np.int64)
+
+
+def integrate_batch(kind, scenario_states, max_steps=None):
+    # Module level, so that worker processes can unpickle it. Impact points,
+    # shape (N, 3), with the same Euler update (and results) as Problem.simulate
+    problem = PROBLEM_CLASSES[kind]
+    scenarios, arrays = _batch_arrays(problem, scenario_states)
+    wind = arrays.pop('wind')
+    projectile = BatchProjectile(
+        init_acc=np.array([sc.init_acc for sc in scenarios]),
+        **arrays
+    )
+    return projectile.simulate(scenarios[0].dt, wind=wind, max_steps=max_steps)
+
+
+def simulate_batch(problem, scenario_states, executor=None):
+    # Impact points, shape (N, 3), of many scenarios of one problem. Cached
+    # results are reused and the rest is integrated in one vectorized pass,
+    # in this process or run by executor (e.g. PRECOMPUTE). Raises ValueError
+    # if a scenario is over the step budget.
+    keys = [state_key(problem.kind, s) for s in scenario_states]
+    poi = np.empty((len(keys), 3))
+
+    missing = {}
+    for i, key in enumerate(keys):
+        xyz = RESULTS.get(key)
+        if xyz is None:
+            missing.setdefault(key, []).append(i)
+        else:
+            poi[i] = xyz[:, -1]
+
+    if missing:
+        first = [scenario_states[rows[0]] for rows in missing.values()]
+        steps = int(predict_steps_batch(problem, first).max())
+        if MAX_STEPS and steps > MAX_STEPS:
+            raise ValueError(f'Scenarios may take at most {MAX_STEPS} steps')
+        # Euler lands within a few steps of the exact flight time, the bound
+        # only stops a batch that would never land
+        args = (problem.kind, first, 2 * steps + 100)
+        if executor is None:
+            pos = integrate_batch(*args)
+        else:
+            pos = executor.run(integrate_batch, *args)
+
+        for (key, rows), p in zip(missing.items(), pos):
+            poi[rows] = p
+            RESULTS.put(key, p.reshape(3, 1))
+    return poi
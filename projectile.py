@@ -1,4 +1,6 @@
 import numpy as np
+
+from wind import WindField
 # import matplotlib
 # matplotlib.use('TkAgg')
 
@@ -38,6 +40,13 @@ def set_axes_equal(ax):
 
 
 class Projectile():
+    __slots__ = (
+        'xk', 'yk', 'zk',
+        'xk_dot', 'yk_dot', 'zk_dot',
+        'xk_dotdot', 'yk_dotdot', 'zk_dotdot',
+        'mass', 'g', 'rho', 'A', 'drag_coeff', 'scaling', 't'
+    )
+
     def __init__(self, init_pos, init_vel, init_acc, mass, rho, A, drag_coeff, g=9.82):
         # init_pos np.array with shape (3, ), ordered by x, y, z
         # init_vel np.array with shape (3, ), ordered by x, y, z
@@ -53,34 +62,153 @@ class Projectile():
         self.A = A  # reference area
         self.drag_coeff = drag_coeff  # drag coefficient
 
+        if drag_coeff is None:
+            self.scaling = None
+        else:
+            self.scaling = float((self.rho * self.drag_coeff * self.A) / (2 * self.mass))
+        self.t = 0.0  # time since launch, for a WindField
+
     def _drag_acc(self, v_wind, v):
         if self.drag_coeff is None:
             drag_acc = 0
         else:
-            scaling = (self.rho * self.drag_coeff * self.A) / (2 * self.mass)
             dv = v_wind - v
-            drag_acc = scaling * np.square(dv) * np.sign(dv)
+            drag_acc = self.scaling * np.square(dv) * np.sign(dv)
         return drag_acc
 #        return 0
 
     def simulate_step(self, dt, wind=None):
         # wind np.array with shape (3, ), ordered by x, y, z
+        self.advance(dt, wind=wind, n_steps=1)
+
+    def advance(self, dt, wind=None, n_steps=None, z_stop=None):
+        # Euler steps on plain floats in one fused loop, numerically identical
+        # to the per-axis NumPy update. Runs n_steps steps (no limit if None),
+        # stopping early after the first step that ends with z < z_stop.
+        # Returns the number of steps taken.
+        if isinstance(wind, WindField):
+            return self._advance_field(dt, wind, n_steps, z_stop)
         if wind is not None:
-            (x_wind, y_wind, z_wind) = wind
+            (x_wind, y_wind, z_wind) = map(float, wind)
         else:
-            (x_wind, y_wind, z_wind) = (None, None, None)
-
-        self.xk_dotdot = self._drag_acc(x_wind, self.xk_dot)
-        self.xk_dot = self.xk_dot + dt * self.xk_dotdot
-        self.xk = self.xk + dt * self.xk_dot
-
-        self.yk_dotdot = self._drag_acc(y_wind, self.yk_dot)
-        self.yk_dot = self.yk_dot + dt * self.yk_dotdot
-        self.yk = self.yk + dt * self.yk_dot
-
-        self.zk_dotdot = self._drag_acc(z_wind, self.zk_dot) - self.g
-        self.zk_dot = self.zk_dot + dt * self.zk_dotdot
-        self.zk = self.zk + dt * self.zk_dot
+            (x_wind, y_wind, z_wind) = (0.0, 0.0, 0.0)
+
+        s = self.scaling
+        g = self.g
+        xk, yk, zk = float(self.xk), float(self.yk), float(self.zk)
+        vx, vy, vz = float(self.xk_dot), float(self.yk_dot), float(self.zk_dot)
+        ax, ay, az = self.xk_dotdot, self.yk_dotdot, self.zk_dotdot
+
+        limit = -1 if n_steps is None else n_steps
+        stop = -np.inf if z_stop is None else z_stop
+        steps = 0
+
+        if s is None:
+            ax, ay, az = 0, 0, -g
+            while steps != limit:
+                vz = vz + dt * az
+                xk = xk + dt * vx
+                yk = yk + dt * vy
+                zk = zk + dt * vz
+                steps += 1
+                if zk < stop:
+                    break
+        else:
+            while steps != limit:
+                dv = x_wind - vx
+                ax = s * (dv * dv)
+                if dv < 0:
+                    ax = -ax
+                vx = vx + dt * ax
+                xk = xk + dt * vx
+
+                dv = y_wind - vy
+                ay = s * (dv * dv)
+                if dv < 0:
+                    ay = -ay
+                vy = vy + dt * ay
+                yk = yk + dt * vy
+
+                dv = z_wind - vz
+                az = s * (dv * dv)
+                if dv < 0:
+                    az = -az
+                az = az - g
+                vz = vz + dt * az
+                zk = zk + dt * vz
+
+                steps += 1
+                if zk < stop:
+                    break
+
+        self.xk, self.yk, self.zk = xk, yk, zk
+        self.xk_dot, self.yk_dot, self.zk_dot = vx, vy, vz
+        self.xk_dotdot, self.yk_dotdot, self.zk_dotdot = ax, ay, az
+        self.t += steps * dt
+        return steps
+
+    def _advance_field(self, dt, field, n_steps, z_stop):
+        # advance() under a WindField, sampled at the altitude and time at
+        # the start of each step. The bilinear coefficients of the current
+        # grid cell are only looked up again once the projectile leaves it.
+        s = self.scaling or 0.0
+        g = self.g
+        t0 = self.t
+        xk, yk, zk = float(self.xk), float(self.yk), float(self.zk)
+        vx, vy, vz = float(self.xk_dot), float(self.yk_dot), float(self.zk_dot)
+        ax, ay, az = self.xk_dotdot, self.yk_dotdot, self.zk_dotdot
+
+        limit = -1 if n_steps is None else n_steps
+        stop = -np.inf if z_stop is None else z_stop
+        steps = 0
+        t = t0
+        z_lo = z_hi = t_hi = 0.0  # empty cell, looked up on the first step
+
+        while steps != limit:
+            if not (z_lo <= zk < z_hi and t < t_hi):
+                z_lo, z_hi, t_hi, z0, c_t0, z_scale, t_scale, coefficients = field.cell(zk, t)
+                ((x0, x1, x2, x3), (y0, y1, y2, y3), (w0, w1, w2, w3)) = coefficients
+            u = (zk - z0) * z_scale
+            v = (t - c_t0) * t_scale
+            uv = u * v
+
+            dv = x0 + x1 * u + x2 * v + x3 * uv - vx
+            ax = s * (dv * dv)
+            if dv < 0:
+                ax = -ax
+            vx = vx + dt * ax
+            xk = xk + dt * vx
+
+            dv = y0 + y1 * u + y2 * v + y3 * uv - vy
+            ay = s * (dv * dv)
+            if dv < 0:
+                ay = -ay
+            vy = vy + dt * ay
+            yk = yk + dt * vy
+
+            dv = w0 + w1 * u + w2 * v + w3 * uv - vz
+            az = s * (dv * dv)
+            if dv < 0:
+                az = -az
+            az = az - g
+            vz = vz + dt * az
+            zk = zk + dt * vz
+
+            steps += 1
+            t = t0 + steps * dt
+            if zk < stop:
+                break
+
+        self.xk, self.yk, self.zk = xk, yk, zk
+        self.xk_dot, self.yk_dot, self.zk_dot = vx, vy, vz
+        self.xk_dotdot, self.yk_dotdot, self.zk_dotdot = ax, ay, az
+        self.t = t
+        return steps
+
+    def acceleration(self, vel, wind=None):
+        # Acceleration at velocity vel (shape (3, )), same model as simulate_step
+        acc = self._drag_acc(wind, vel) + np.array([0, 0, -self.g])
+        return acc
 
     def get_current_pos(self):
         p = [self.xk, self.yk, self.zk]
@@ -95,6 +223,135 @@ class Projectile():
         return np.array(a)
 
 
+class BatchProjectile():
+    # Steps N projectiles at once with the same per-axis quadratic drag Euler
+    # update as Projectile. Rows whose z drops below `ground` are marked as
+    # landed and are left untouched by subsequent steps.
+    def __init__(self, init_pos, init_vel, init_acc, mass, rho, A, drag_coeff, g=9.82,
+                 ground=0.0001):
+        # init_pos np.array with shape (N, 3), ordered by x, y, z
+        # init_vel np.array with shape (N, 3), ordered by x, y, z
+        # init_acc np.array with shape (N, 3), ordered by x, y, z
+        # mass, rho, A and drag_coeff are scalars or np.array with shape (N, )
+        self.pos = np.array(init_pos, dtype=np.float64, ndmin=2)
+        self.vel = np.array(init_vel, dtype=np.float64, ndmin=2)
+        self.acc = np.array(init_acc, dtype=np.float64, ndmin=2)
+        self.n = self.pos.shape[0]
+
+        self.mass = mass
+        self.g = g
+        self.ground = ground
+
+        self.rho = rho  # mass density of fluid
+        self.A = A  # reference area
+        self.drag_coeff = drag_coeff  # drag coefficient
+
+        if drag_coeff is None:
+            self.scaling = None
+        else:
+            scaling = (np.asarray(rho) * np.asarray(drag_coeff) * np.asarray(A)) / \
+                (2 * np.asarray(mass))
+            self.scaling = np.broadcast_to(scaling, (self.n, )).reshape(-1, 1)
+
+        self.landed = np.zeros(self.n, dtype=bool)
+        self.steps = np.zeros(self.n, dtype=np.int64)
+        self._active = np.arange(self.n)
+        self.t = 0.0  # time since launch, shared by all rows
+        self._stepped = 0
+        self._cells = None  # WindField cell of each row, see _field_wind
+
+    def _drag_acc(self, v_wind, v, scaling):
+        if scaling is None:
+            drag_acc = np.zeros_like(v)
+        else:
+            dv = v_wind - v
+            drag_acc = scaling * np.square(dv) * np.sign(dv)
+        return drag_acc
+
+    def _field_wind(self, field, z, idx):
+        # Wind at the rows idx, at altitudes z, evaluated as
+        # Projectile._advance_field does: from the coefficients of the grid
+        # cell each row was last in, looked up again once it leaves that cell
+        t = self.t
+        if self._cells is None:
+            empty = np.zeros(self.n)  # no row is in it, see _advance_field
+            self._cells = [empty, empty.copy(), empty.copy(), empty.copy(), empty.copy(),
+                           np.zeros((self.n, 3, 4))]
+        z_lo, z_hi, t_hi, z0, t0, coefficients = self._cells
+
+        stale = ~((z_lo[idx] <= z) & (z < z_hi[idx]) & (t < t_hi[idx]))
+        if stale.any():
+            rows = idx[stale]
+            for cached, looked_up in zip(self._cells, field.cells(z[stale], t)):
+                cached[rows] = looked_up
+
+        u = ((z - z0[idx]) * (1 / field.z_step))[:, None]
+        v = ((t - t0[idx]) * (1 / field.t_step))[:, None]
+        c = coefficients[idx]
+        return c[..., 0] + c[..., 1] * u + c[..., 2] * v + c[..., 3] * (u * v)
+
+    def simulate_step(self, dt, wind=None):
+        # wind np.array with shape (3, ) or (N, 3), ordered by x, y, z, or a
+        # WindField (sampled at each row's altitude)
+        idx = self._active
+        if idx.size == 0:
+            return
+
+        all_active = idx.size == self.n
+        pos = self.pos if all_active else self.pos[idx]
+        vel = self.vel if all_active else self.vel[idx]
+        scaling = self.scaling
+        if scaling is not None and not all_active:
+            scaling = scaling[idx]
+
+        if wind is None:
+            v_wind = 0.0
+        elif isinstance(wind, WindField):
+            v_wind = self._field_wind(wind, pos[:, 2], idx)
+        else:
+            v_wind = np.asarray(wind)
+            if v_wind.ndim == 2 and not all_active:
+                v_wind = v_wind[idx]
+
+        acc = self._drag_acc(v_wind, vel, scaling)
+        acc[:, 2] -= self.g
+        vel = vel + dt * acc
+        pos = pos + dt * vel
+
+        if all_active:
+            self.acc, self.vel, self.pos = acc, vel, pos
+        else:
+            self.acc[idx], self.vel[idx], self.pos[idx] = acc, vel, pos
+        self.steps[idx] += 1
+        # As in Projectile.advance, t is counted in steps rather than summed
+        self._stepped += 1
+        self.t = self._stepped * dt
+
+        landed = pos[:, 2] < self.ground
+        if landed.any():
+            self.landed[idx[landed]] = True
+            self._active = idx[~landed]
+
+    def simulate(self, dt, wind=None, max_steps=None):
+        # Steps until every projectile has landed (or max_steps is reached)
+        step = 0
+        while self._active.size > 0:
+            if max_steps is not None and step >= max_steps:
+                break
+            self.simulate_step(dt, wind=wind)
+            step += 1
+        return self.get_current_pos()
+
+    def get_current_pos(self):
+        return self.pos.copy()
+
+    def get_current_vel(self):
+        return self.vel.copy()
+
+    def get_current_acc(self):
+        return self.acc.copy()
+
+
 def ms_to_kmh(ms):
     kmh = (ms / 1000) * 3600
     return kmh
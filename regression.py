@@ -0,0 +1,194 @@
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from aim import impact_2d
+from cache import RESULTS
+from grading import MARGIN_X, MARGIN_XYZ, grade_x, grade_xyz
+from problems import DELTA_T, IMPACT_TABLE, Problem1, Problem2, Problem3, Problem4, simulate_batch
+from salvo import Salvo
+
+PROBLEMS = {p.kind: p for p in (Problem1, Problem2, Problem3, Problem4)}
+
+# Grading compares guesses with the impact point of Euler at DELTA_T. Every
+# other engine is checked against it on the same seeded scenarios: how far
+# its impact points are, how long it takes and, on probe guesses scattered
+# within two margins of the reference, whether it would accept or reject
+# any of them differently.
+PERCENTILES = (50, 90, 99)
+
+
+def impact(problem, xyz):
+    # The point of impact, shape (3, ), or for a salvo one per projectile,
+    # shape (SALVO_SIZE, 3)
+    return xyz.T if problem is Problem4 else xyz[:, -1]
+
+
+def scalar(**kwargs):
+    # Problem.simulate of one scenario at a time, with these settings
+    def engine(problem, scenario_states):
+        return np.array([impact(problem, problem.simulate(s, **kwargs)) for s in scenario_states])
+    return engine
+
+
+def batch(problem, scenario_states):
+    RESULTS.clear()
+    poi = simulate_batch(problem, scenario_states)
+    RESULTS.clear()
+    return poi
+
+
+def table(problem, scenario_states):
+    # What Problem.impact_point serves with $IMPACT_TABLE: the table where
+    # its error bound allows, the simulation elsewhere
+    instance = problem()
+    poi = []
+    for scenario_state in scenario_states:
+        xyz = instance.table_point(scenario_state)
+        if xyz is None:
+            xyz = problem.simulate(scenario_state)
+        poi.append(xyz[:, -1])
+    return np.array(poi)
+
+
+def corrected(problem, scenario_states):
+    # Closed form plus the first-order Euler term (see impact_table.impact_x)
+    poi = []
+    for scenario_state in scenario_states:
+        scenario = problem.scenario(scenario_state)
+        shot = problem.shot(scenario_state)
+        if problem is Problem3:
+            poi.append(Salvo([scenario], engine='corrected').shoot(shot)[:, 0])
+        else:
+            poi.append([impact_2d(scenario, *shot), 0, 0])
+    return np.array(poi)
+
+
+ENGINES = {
+    'euler-full': scalar(record='full'),
+    'rk45': scalar(engine='rk45'),
+    'analytic': scalar(engine='analytic'),
+    'batch': batch,
+    'table': table,  # only with $IMPACT_TABLE, problem1 and problem2
+    'corrected': corrected,
+}
+
+# problem4 is graded with the Euler loop of salvo.Salvo, and checked against
+# the other engines of a salvo
+SALVO_ENGINES = {
+    'batch': scalar(engine='batch'),
+    'corrected': scalar(engine='corrected'),
+    'analytic': scalar(engine='analytic'),
+}
+
+
+def engines(kind):
+    if kind == 'problem4':
+        return SALVO_ENGINES
+    return ENGINES
+
+
+def available(kind, engine):
+    if engine not in engines(kind):
+        return False
+    return engine != 'table' or (IMPACT_TABLE is not None and PROBLEMS[kind].tabulated)
+
+
+def probe_guesses(kind, reference, n, rng):
+    # n guesses per scenario, uniform within two margins of the reference
+    # (of each projectile of a salvo)
+    if kind in ('problem3', 'problem4'):
+        shape = (len(reference), n, *reference.shape[1:-1])
+        r = 2 * MARGIN_XYZ * np.sqrt(rng.uniform(size=shape))
+        phi = rng.uniform(0, 2 * np.pi, size=shape)
+        offsets = np.stack([r * np.cos(phi), r * np.sin(phi), np.zeros_like(r)], axis=-1)
+        return reference[:, None] + offsets
+    return reference[:, None, 0] + rng.uniform(-2 * MARGIN_X, 2 * MARGIN_X, (len(reference), n))
+
+
+def grade(kind, guesses, poi):
+    # Accept/reject of every guess, as the scenario routes grade them: a
+    # salvo only if every projectile is within the margin
+    if kind == 'problem4':
+        return grade_xyz(guesses, poi[:, None])[1].all(axis=-1)
+    if kind == 'problem3':
+        return grade_xyz(guesses, poi[:, None, :])[1]
+    return grade_x(guesses, poi[:, None, 0])[1]
+
+
+def deviation(kind, poi, reference):
+    # Per scenario, or per projectile of a salvo
+    if kind in ('problem3', 'problem4'):
+        return np.linalg.norm(poi - reference, axis=-1).ravel()
+    return np.abs(poi[:, 0] - reference[:, 0])
+
+
+def timed(engine, problem, scenario_states):
+    t0 = time.perf_counter()
+    poi = engine(problem, scenario_states)
+    return poi, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=f'Compare every engine with the grading reference, Euler at dt={DELTA_T}'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenarios', type=int, default=50, help='scenarios per problem')
+    parser.add_argument('--problems', default=','.join(PROBLEMS))
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--probes', type=int, default=1000, help='probe guesses per scenario')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    results = {}
+    flipped = []
+    for kind in args.problems.split(','):
+        problem = PROBLEMS[kind]
+        scenario_states = problem().sample_states(rng, args.scenarios)
+
+        reference, wall = timed(scalar(), problem, scenario_states)
+        reference[..., 2] = 0  # Set z to zero, as graded
+        guesses = probe_guesses(kind, reference, args.probes, rng)
+        accepted = grade(kind, guesses, reference)
+
+        print(f'{kind}: {len(scenario_states)} scenarios, {args.probes} probe guesses each')
+        print(f"  {'euler (reference)':18s} {'':53s} wall {wall:8.2f} s")
+        results[kind] = {'euler': {'wall [s]': wall}}
+        for name in args.engines.split(','):
+            if not available(kind, name):
+                continue
+            poi, wall = timed(engines(kind)[name], problem, scenario_states)
+            poi[..., 2] = 0
+            d = deviation(kind, poi, reference)
+            flips = int(np.count_nonzero(grade(kind, guesses, poi) != accepted))
+            results[kind][name] = {
+                'wall [s]': wall,
+                'deviation [m]': {
+                    **{f'p{q}': float(np.percentile(d, q)) for q in PERCENTILES},
+                    'max': float(d.max()),
+                },
+                'flips': flips,
+            }
+            print(f'  {name:18s} deviation p50 {np.percentile(d, 50):9.2e}  '
+                  f'p99 {np.percentile(d, 99):9.2e}  max {d.max():9.2e} m  '
+                  f'wall {wall:8.2f} s  flips {flips}')
+            if flips:
+                flipped.append(f'{name} on {kind}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if flipped:
+        print('Grading would change: ' + ', '.join(flipped))
+        sys.exit(1)
+    print('No engine changes any accept/reject decision')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import numpy as np
+
+from analytic import AnalyticProjectile
+from impact_table import drag_scaling, impact_x, vertical_solution
+from projectile import BatchProjectile
+
+ENGINES = ('euler', 'batch', 'corrected', 'analytic')
+
+
+class Salvo():
+    # Scenario3D shots fired together, their points of impact computed in one
+    # call. Engines:
+    #   euler:     Scenario3D.shoot of each projectile in turn, the Euler loop
+    #              that grading is defined by (problem4 grades with it)
+    #   batch:     BatchProjectile, the very same Euler steps, and results, as
+    #              euler. A step costs ~15 us of NumPy calls against ~0.6 us
+    #              in the fused scalar loop, and the batch runs as long as its
+    #              longest flight, so it only pays off for hundreds of
+    #              projectiles: a salvo of 4 takes ~20 times as long as euler.
+    #   corrected: the closed-form solution plus the first-order error term of
+    #              the Euler loop at the scenarios' dt (see impact_table), within
+    #              about a centimetre of euler, whatever the salvo size. It
+    #              takes no steps (n_steps is 0, as for analytic).
+    #   analytic:  the exact solution
+    # Same interface as Scenario3D, except that xyz has one column per
+    # projectile, its point of impact. No vertical wind.
+    def __init__(self, scenarios, engine='euler'):
+        if engine not in ENGINES:
+            raise ValueError(f'Unknown engine: {engine}')
+        if any(sc.wind is None for sc in scenarios):
+            raise ValueError('Salvos need scenarios with drag')
+
+        self.scenarios = scenarios
+        self.engine = engine
+        self.dt = scenarios[0].dt
+
+        self.xyz = None
+        self.n_steps = None
+        self.flight_time = None
+
+    def _stack(self, name):
+        return np.array([getattr(sc, name) for sc in self.scenarios], dtype=np.float64)
+
+    def shoot(self, *shots, record='impact'):
+        # One (phi_in_deg, theta_in_deg, speed) shot per scenario
+        if record != 'impact':
+            raise ValueError(f'Salvos only record points of impact, not {record}')
+
+        init_vel = np.array([sc.initial_velocity(*shot) for sc, shot in zip(self.scenarios, shots)])
+        arrays = {
+            'mass': self._stack('mass'),
+            'rho': self._stack('rho'),
+            'A': self._stack('A'),
+            'drag_coeff': self._stack('drag_coeff'),
+        }
+        wind = self._stack('wind')
+
+        if self.engine == 'euler':
+            for sc, shot in zip(self.scenarios, shots):
+                sc.shoot(*shot, record='impact')
+            pos = np.array([sc.xyz[:, -1] for sc in self.scenarios])
+            self.n_steps = max(sc.n_steps for sc in self.scenarios)
+            self.flight_time = max(sc.flight_time for sc in self.scenarios)
+        elif self.engine == 'batch':
+            projectile = BatchProjectile(
+                init_pos=self._stack('init_pos'),
+                init_vel=init_vel,
+                init_acc=self._stack('init_acc'),
+                **arrays
+            )
+            pos = projectile.simulate(self.dt, wind=wind)
+            self.n_steps = int(projectile.steps.max())
+            self.flight_time = self.n_steps * self.dt
+        elif self.engine == 'analytic':
+            projectile = AnalyticProjectile(
+                init_pos=self._stack('init_pos'),
+                init_vel=init_vel,
+                wind=wind,
+                **arrays
+            )
+            t_impact = projectile.impact_time()
+            pos = projectile.get_pos(t_impact)
+            self.n_steps = 0
+            self.flight_time = float(t_impact.max())
+        else:
+            # Launched from the origin, as in Scenario3D; z is the ground
+            s = drag_scaling(**arrays)
+            t, vz1, dz = vertical_solution(s, init_vel[:, 2])
+            pos = np.zeros_like(init_vel)
+            for axis in (0, 1):
+                pos[:, axis], _, _ = impact_x(
+                    s, init_vel[:, axis], wind[:, axis], t, vz1, dz, self.dt
+                )
+            self.n_steps = 0
+            self.flight_time = float(t.max())
+
+        self.xyz = pos.T
+        return self.xyz
@@ -0,0 +1,216 @@
+import numpy as np
+
+from projectile import Projectile
+from analytic import AnalyticProjectile
+from integrators import solve_rk45
+from trajectory import TrajectoryRecorder
+
+# euler is the grading reference. rk45 is the accurate time-stepping engine:
+# adaptive steps, about 80 per flight against ~10^5 for Euler at dt=0.0001,
+# ~12 ms per scenario and within ~2 mm of the closed-form impact point.
+ENGINES = ('euler', 'rk45', 'analytic')
+
+
+class Scenario():
+    # Engines and record modes shared by Scenario2D and Scenario3D, which
+    # only differ in how a shot becomes an initial velocity: their shoot()
+    # computes it and hands over to _shoot().
+    def __init__(self, dt=0.001, mass=0.080, rho=1.2, r=0.045, drag_coeff=0.47, wind=None,
+                 engine='euler', record_stride=1, max_points=None, record_dtype=np.float64):
+        if engine not in ENGINES:
+            raise ValueError(f'Unknown engine: {engine}')
+
+        self.dt = dt
+        self.engine = engine
+
+        self.mass = mass
+        self.rho = rho
+        self.A = np.pi * np.square(r)
+        self.drag_coeff = drag_coeff
+        self.wind = wind  # (3, ) array or wind.WindField; None for no drag
+
+        self.init_pos = np.zeros(3)
+        self.init_acc = np.zeros(3)
+
+        self.xyz = None
+        self.distance = None
+        self.n_steps = None
+        self.flight_time = None
+
+        # Full trajectories: record every record_stride steps, keeping at most
+        # max_points points (see TrajectoryRecorder)
+        self.record_stride = record_stride
+        self.max_points = max_points
+        self.record_dtype = record_dtype
+        self.t = None
+        self.recorder = None
+
+    def _simulate_trajectory(self):
+        recorder = TrajectoryRecorder(
+            stride=self.record_stride,
+            max_points=self.max_points,
+            dtype=self.record_dtype
+        )
+        recorder.record(0, *self.init_pos)
+        projectile = self.projectile
+        n_steps = 0
+
+        while True:
+            n_steps += self._advance(recorder.stride)
+            if projectile.zk < 0.0001:
+                break
+            recorder.record(n_steps * self.dt, projectile.xk, projectile.yk, projectile.zk)
+
+        timer = n_steps * self.dt
+        pos = projectile.get_current_pos()
+        recorder.record(timer, *pos)
+
+        self.n_steps = n_steps
+        self.flight_time = timer
+        self.recorder = recorder
+
+        txyz = recorder.to_array()
+        self.t = txyz[0]
+        xyz = txyz[1:]
+        return xyz
+
+    def iter_trajectory(self, stride=1):
+        # Generator form of _simulate_trajectory: integrates while yielding
+        # (t, x, y, z) every stride steps, and the point of impact last.
+        # Nothing is recorded, so memory does not grow with the flight.
+        projectile = self.projectile
+        n_steps = 0
+        yield (0.0, *self.init_pos)
+
+        while True:
+            n_steps += self._advance(stride)
+            if projectile.zk < 0.0001:
+                break
+            yield (n_steps * self.dt, projectile.xk, projectile.yk, projectile.zk)
+
+        timer = n_steps * self.dt
+        pos = projectile.get_current_pos()
+
+        self.n_steps = n_steps
+        self.flight_time = timer
+        self.xyz = pos.reshape(3, 1)
+        yield (timer, *pos)
+
+    def _simulate_impact(self):
+        # Same integration as _simulate_trajectory, but only the final state is kept
+        n_steps = self._advance()
+        timer = n_steps * self.dt
+
+        pos = self.projectile.get_current_pos()
+
+        self.n_steps = n_steps
+        self.flight_time = timer
+
+        # Shaped (3, 1) so that xyz[:, -1] is the point of impact in both modes
+        xyz = pos.reshape(3, 1)
+        return xyz
+
+    def _advance(self, n_steps=None):
+        # Up to n_steps Euler steps (no limit if None), stopping once below
+        # ground; a fused loop, no per-step Python call overhead
+        return self.projectile.advance(self.dt, wind=self.wind, n_steps=n_steps, z_stop=0.0001)
+
+    def _solve_rk45(self, record):
+        # Adaptive step size; the ground crossing is located by an event
+        sol = solve_rk45(self.projectile, wind=self.wind)
+        t_impact = sol.t_events[0][0]
+        poi = sol.y_events[0][0][:3]
+
+        if record == 'full':
+            self.t = self._sample_times(t_impact)
+            xyz = np.column_stack([sol.sol(self.t[:-1])[:3], poi])
+            xyz = xyz.astype(self.record_dtype, copy=False)
+        elif record == 'impact':
+            xyz = poi.reshape(3, 1)
+        else:
+            raise ValueError(f'Unknown record mode: {record}')
+
+        self.n_steps = len(sol.t) - 1
+        self.flight_time = t_impact
+        return xyz
+
+    def _solve_analytic(self, init_vel, record):
+        # Exact solution of the same model; no time stepping involved
+        drag = self.wind is not None
+        self.projectile = AnalyticProjectile(
+            init_pos=self.init_pos,
+            init_vel=init_vel,
+            mass=self.mass if drag else None,
+            rho=self.rho if drag else None,
+            A=self.A if drag else None,
+            drag_coeff=self.drag_coeff if drag else None,
+            wind=self.wind
+        )
+        t_impact = self.projectile.impact_time()
+
+        if record == 'full':
+            t = self._sample_times(t_impact)
+            self.t = t
+        elif record == 'impact':
+            t = np.array([t_impact])
+        else:
+            raise ValueError(f'Unknown record mode: {record}')
+
+        self.n_steps = 0
+        self.flight_time = t_impact
+
+        xyz = self.projectile.get_pos(t).T
+        if record == 'full':
+            xyz = xyz.astype(self.record_dtype, copy=False)
+        return xyz
+
+    def _sample_times(self, t_impact):
+        # Recording times for engines that can be evaluated at any t
+        spacing = self.dt * self.record_stride
+        if self.max_points is not None:
+            spacing = max(spacing, t_impact / (self.max_points - 1))
+        return np.append(np.arange(0, t_impact, spacing), t_impact)
+
+    def _shoot(self, init_vel, record):
+        if record == 'stream' and self.engine != 'euler':
+            raise ValueError(f'Only the time-stepping engine can stream, not {self.engine}')
+
+        if self.engine == 'analytic':
+            self.xyz = self._solve_analytic(init_vel, record)
+            return self.xyz
+
+        if self.wind is not None:
+            self.projectile = Projectile(
+                init_pos=self.init_pos,
+                init_vel=init_vel,
+                init_acc=self.init_acc,
+                mass=self.mass,
+                rho=self.rho,
+                A=self.A,
+                drag_coeff=self.drag_coeff
+            )
+        else:
+            self.projectile = Projectile(
+                init_pos=self.init_pos,
+                init_vel=init_vel,
+                init_acc=self.init_acc,
+                mass=None,
+                rho=None,
+                A=None,
+                drag_coeff=None
+            )
+
+        if self.engine == 'rk45':
+            self.xyz = self._solve_rk45(record)
+        elif record == 'full':
+            self.xyz = self._simulate_trajectory()
+        elif record == 'impact':
+            self.xyz = self._simulate_impact()
+        elif record == 'stream':
+            # A generator of (t, x, y, z), see iter_trajectory
+            return self.iter_trajectory(self.record_stride)
+        else:
+            raise ValueError(f'Unknown record mode: {record}')
+
+        return self.xyz
+
@@ -1,50 +1,12 @@
 import numpy as np
 #import matplotlib
 
-from projectile import Projectile
+from scenario import Scenario
 
 
-class Scenario3D():
-    def __init__(self, dt=0.001, mass=0.080, rho=1.2, r=0.045, drag_coeff=0.47, wind=None):
-        self.dt = dt
-
-        self.mass = mass
-        self.rho = rho
-        self.A = np.pi * np.square(r)
-        self.drag_coeff = drag_coeff
-        self.wind = wind
-
-        self.init_pos = np.zeros(3)
-        self.init_acc = np.zeros(3)
-
-        self.xyz = None
-        self.distance = None
-
-    def _simulate_trajectory(self):
-        t = [0]
-        x, y, z = map(lambda i: [i], self.init_pos.tolist())
-        timer = 0
-
-        while True:
-            self.projectile.simulate_step(self.dt, wind=self.wind)
-            pos = self.projectile.get_current_pos()
-            timer += self.dt
-
-            t.append(timer)
-
-            x.append(pos[0])
-            y.append(pos[1])
-            z.append(pos[2])
-            if z[-1] < 0.0001:
-                break
-
-        xyz = np.array([x, y, z])
-        return xyz
-
-    def shoot(self, phi_in_deg, theta_in_deg, speed):
-        self.phi_in_deg = phi_in_deg
-        self.theta_in_deg = theta_in_deg
-
+class Scenario3D(Scenario):
+    @staticmethod
+    def initial_velocity(phi_in_deg, theta_in_deg, speed):
         phi_rads = np.deg2rad(phi_in_deg)
         theta_rads = np.deg2rad(theta_in_deg)
 
@@ -52,32 +14,15 @@ class Scenario3D():
         y = np.cos(theta_rads) * np.sin(phi_rads) * speed
         z = np.sin(theta_rads) * speed
 
-        init_vel = np.array([x, y, z])
-
-        if self.wind is not None:
-            self.projectile = Projectile(
-                init_pos=self.init_pos,
-                init_vel=init_vel,
-                init_acc=self.init_acc,
-                mass=self.mass,
-                rho=self.rho,
-                A=self.A,
-                drag_coeff=self.drag_coeff
-            )
-        else:
-            self.projectile = Projectile(
-                init_pos=self.init_pos,
-                init_vel=init_vel,
-                init_acc=self.init_acc,
-                mass=None,
-                rho=None,
-                A=None,
-                drag_coeff=None
-            )
-
-        self.xyz = self._simulate_trajectory()
-
-        return self.xyz
+        return np.array([x, y, z])
+
+    def shoot(self, phi_in_deg, theta_in_deg, speed, record='full'):
+        self.phi_in_deg = phi_in_deg
+        self.theta_in_deg = theta_in_deg
+
+        init_vel = self.initial_velocity(phi_in_deg, theta_in_deg, speed)
+
+        return self._shoot(init_vel, record)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,80 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from precompute import Saturated, in_pool_worker
+
+log = logging.getLogger(__name__)
+
+
+class ScenarioPool():
+    # Ready-to-serve scenario states of one problem, whose impact points are
+    # already in RESULTS. pop() is O(1); once the pool is down to low_water
+    # states, a background thread samples a vectorized batch (see
+    # Problem.sample_states), has the REFILL workers solve it and refills
+    # the pool up to size.
+    def __init__(self, problem, size=64, low_water=None, seed=None):
+        self.problem = problem
+        self.size = size
+        self.low_water = size // 4 if low_water is None else low_water
+
+        # Distinct streams per problem, even when seeded alike
+        if seed is not None:
+            seed = [seed, *problem.kind.encode()]
+        self.rng = np.random.default_rng(seed)
+
+        self.ready = deque()
+        self.refilling = False
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ready)
+
+    def pop(self):
+        # None if the pool has run dry
+        try:
+            scenario_state = self.ready.popleft()
+        except IndexError:
+            scenario_state = None
+
+        if len(self.ready) <= self.low_water:
+            self.refill()
+        return scenario_state
+
+    def refill(self, wait=False):
+        with self.lock:
+            if self.refilling or in_pool_worker():
+                return
+            self.refilling = True
+        thread = threading.Thread(target=self._refill, daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+
+    def _refill(self, max_backoff=60):
+        backoff = 1
+        try:
+            while len(self.ready) < self.size:
+                scenario_states = self.problem.sample_states(self.rng, self.size - len(self.ready))
+                try:
+                    self.problem.solve_states(scenario_states)
+                except Saturated as e:
+                    # The other pools are refilling, or a worker died and the
+                    # pool restarts on the next submission; try again later
+                    time.sleep(e.retry_after)
+                    continue
+                except Exception as e:
+                    # Anything else must not end the thread on every pop();
+                    # retried, less and less often while it keeps failing
+                    log.warning('Refilling the %s pool failed (%r), retrying in %s s',
+                                self.problem.kind, e, backoff)
+                    time.sleep(backoff)
+                    backoff = min(2 * backoff, max_backoff)
+                    continue
+                backoff = 1
+                self.ready.extend(scenario_states)
+        finally:
+            self.refilling = False
@@ -0,0 +1,137 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from grading import MARGIN_X, MARGIN_XYZ
+from problems import DELTA_T, PROBLEM_CLASSES, run_simulation
+
+# How far the impact point moves when a scenario parameter moves by its
+# rounding (states are rounded to 2 decimals, see Parameters.new), and when
+# the Euler step changes. Compared with the acceptance margins, this says
+# how hard a scenario is to get right and how fine DELTA_T needs to be.
+#
+# Parameter sensitivities are central differences of the exact (analytic)
+# solution; those of the Euler solution only differ at O(dt). The dt
+# columns are the distance of the Euler impact point from the exact one.
+
+ROUNDING = 0.005
+MARGINS = {'problem1': MARGIN_X, 'problem2': MARGIN_X, 'problem3': MARGIN_XYZ}
+PERCENTILES = (50, 90, 99)
+
+
+def rounded_keys(problem):
+    return [key for key in problem.state_keys if not key.startswith('delta T')]
+
+
+def impact(kind, scenario_state, **kwargs):
+    xyz, _ = run_simulation(kind, scenario_state, **kwargs)
+    return xyz[:, -1]
+
+
+def distance(kind, a, b):
+    # As graded: along x for the 2D problems, Euclidean for problem3
+    if kind == 'problem3':
+        return float(np.linalg.norm(a - b))
+    return float(abs(a[0] - b[0]))
+
+
+def analyse(kind, scenario_states, dts):
+    # Sensitivities of each scenario, as a dict per scenario. Module level,
+    # so that worker processes can unpickle it.
+    rows = []
+    for scenario_state in scenario_states:
+        exact = impact(kind, scenario_state, engine='analytic')
+        row = {}
+        for key in rounded_keys(PROBLEM_CLASSES[kind]):
+            up, down = (
+                impact(kind, dict(scenario_state, **{key: scenario_state[key] + step}),
+                       engine='analytic')
+                for step in (ROUNDING, -ROUNDING)
+            )
+            row[f'rounding {key}'] = distance(kind, up, down) / 2
+        row['rounding (sum)'] = sum(row.values())
+        for dt in dts:
+            row[f'dt {dt:g}'] = distance(kind, impact(kind, scenario_state, dt=dt), exact)
+        rows.append(row)
+    return rows
+
+
+def aggregate(kind, rows, elapsed):
+    stats = {}
+    for column in rows[0]:
+        values = np.array([row[column] for row in rows])
+        stats[column] = {
+            'mean': values.mean(),
+            **{f'p{q}': np.percentile(values, q) for q in PERCENTILES},
+            'max': values.max(),
+            'over margin': np.mean(values >= MARGINS[kind]),
+        }
+        stats[column] = {k: float(f'{v:.4g}') for k, v in stats[column].items()}
+    return {
+        'problem': kind,
+        'scenarios': len(rows),
+        'margin [m]': MARGINS[kind],
+        'elapsed [s]': round(elapsed, 1),
+        'stats': stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Sample scenarios and measure how sensitive their impact points are'
+    )
+    parser.add_argument('output', help='file to append the aggregated statistics to (JSON lines)')
+    parser.add_argument('--scenarios', type=int, default=1000, help='scenarios per problem')
+    parser.add_argument('--problems', default=','.join(MARGINS))
+    parser.add_argument('--dts', default=f'{10 * DELTA_T:g},{2 * DELTA_T:g},{DELTA_T:g}',
+                        help='Euler time steps to compare with the exact solution')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk', type=int, default=8, help='scenarios per task')
+    parser.add_argument('--every', type=int, default=200,
+                        help='write the statistics every this many scenarios of a problem')
+    args = parser.parse_args()
+
+    dts = [float(dt) for dt in args.dts.split(',') if dt]
+    rng = np.random.default_rng(args.seed)
+    rows = {}
+    futures = {}
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers,
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        for kind in args.problems.split(','):
+            problem = PROBLEM_CLASSES[kind]
+            states = problem().sample_states(rng, args.scenarios)
+            rows[kind] = []
+            for i in range(0, len(states), args.chunk):
+                future = executor.submit(analyse, kind, states[i:i + args.chunk], dts)
+                futures[future] = kind
+
+        with open(args.output, 'a') as f:
+            for future in as_completed(futures):
+                kind = futures[future]
+                done = len(rows[kind])
+                rows[kind].extend(future.result())
+                if len(rows[kind]) // args.every > done // args.every:
+                    f.write(json.dumps(aggregate(kind, rows[kind], time.perf_counter() - t0)))
+                    f.write('\n')
+                    f.flush()
+
+            for kind, problem_rows in rows.items():
+                summary = aggregate(kind, problem_rows, time.perf_counter() - t0)
+                summary['final'] = True
+                f.write(json.dumps(summary) + '\n')
+
+                print(f"{kind}: {summary['scenarios']} scenarios, margin {MARGINS[kind]} m")
+                for column, stat in summary['stats'].items():
+                    print(f"  {column:60s} p50 {stat['p50']:9.4g}  p99 {stat['p99']:9.4g}  "
+                          f"max {stat['max']:9.4g}  over margin {stat['over margin']:6.1%}")
+
+
+if __name__ == '__main__':
+    main()
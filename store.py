@@ -0,0 +1,133 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryStore():
+    # Scenario states per (session, problem kind), local to this process. So
+    # are its claims: another process would grade a scenario token again.
+    def __init__(self, max_sessions=10000, max_age=24 * 3600):
+        self.max_sessions = max_sessions
+        self.max_age = max_age
+        self.states = OrderedDict()
+        self.claimed = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, session, kind):
+        with self.lock:
+            key = (session, kind)
+            if key not in self.states:
+                return None
+            self.states.move_to_end(key)
+            return self.states[key]
+
+    def put(self, session, kind, scenario_state):
+        with self.lock:
+            key = (session, kind)
+            self.states[key] = scenario_state
+            self.states.move_to_end(key)
+            while len(self.states) > self.max_sessions:
+                self.states.popitem(last=False)
+
+    def claim(self, key):
+        # True the first time a key is claimed, False afterwards
+        now = time.time()
+        with self.lock:
+            while self.claimed and next(iter(self.claimed.values())) < now - self.max_age:
+                self.claimed.popitem(last=False)
+            if key in self.claimed:
+                return False
+            self.claimed[key] = now
+            return True
+
+
+class SQLiteStore():
+    # Scenario states per (session, problem kind) in a SQLite file, shared by
+    # every process (e.g. gunicorn worker) on the machine. Replicas on other
+    # machines do not see its claims, and would grade scenario tokens again.
+    def __init__(self, path, max_age=24 * 3600):
+        self.path = path
+        self.max_age = max_age
+        self.local = threading.local()
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS scenarios ('
+            '  session TEXT NOT NULL,'
+            '  kind TEXT NOT NULL,'
+            '  state TEXT NOT NULL,'
+            '  updated REAL NOT NULL,'
+            '  PRIMARY KEY (session, kind))'
+        )
+        self._connect().execute(
+            'CREATE INDEX IF NOT EXISTS scenarios_updated ON scenarios (updated)'
+        )
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS claims ('
+            '  key TEXT PRIMARY KEY,'
+            '  claimed REAL NOT NULL)'
+        )
+        self._connect().execute(
+            'CREATE INDEX IF NOT EXISTS claims_claimed ON claims (claimed)'
+        )
+
+    def _connect(self):
+        # One connection per thread and process; connections must not be
+        # carried across a fork
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def get(self, session, kind):
+        row = self._connect().execute(
+            'SELECT state FROM scenarios WHERE session = ? AND kind = ?',
+            (session, kind)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, session, kind, scenario_state):
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO scenarios (session, kind, state, updated) VALUES (?, ?, ?, ?)',
+            (session, kind, json.dumps(scenario_state), now)
+        )
+        conn.execute('DELETE FROM scenarios WHERE updated < ?', (now - self.max_age, ))
+
+    def claim(self, key):
+        # True the first time a key is claimed by any process, False afterwards
+        now = time.time()
+        conn = self._connect()
+        conn.execute('DELETE FROM claims WHERE claimed < ?', (now - self.max_age, ))
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO claims (key, claimed) VALUES (?, ?)',
+            (key, now)
+        )
+        return cursor.rowcount == 1
+
+
+def make_store(url=None, workers=None):
+    # 'memory' (default) or 'sqlite:<path>', read from $SCENARIO_STORE. The
+    # memory store only serves a single worker process ($WEB_CONCURRENCY).
+    if url is None:
+        url = os.environ.get('SCENARIO_STORE', 'memory')
+    if workers is None:
+        workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+    if url == 'memory':
+        if workers > 1:
+            raise ValueError(
+                f'{workers} workers cannot share the memory scenario store, '
+                'set SCENARIO_STORE=sqlite:<path>'
+            )
+        return MemoryStore()
+    if url.startswith('sqlite:'):
+        return SQLiteStore(url[len('sqlite:'):])
+    raise ValueError(f'Unknown scenario store: {url}')
@@ -0,0 +1,51 @@
+import os
+import secrets
+
+from itsdangerous import BadSignature, Signer, URLSafeTimedSerializer
+
+# All workers and replicas must share the key for tokens and session ids to
+# be portable. The random fallback only works for a single process.
+SECRET_KEY = os.environ.get('SCENARIO_SECRET_KEY')
+if SECRET_KEY is None:
+    if int(os.environ.get('WEB_CONCURRENCY', 1)) > 1:
+        raise ValueError('Several workers need a shared key, set SCENARIO_SECRET_KEY')
+    SECRET_KEY = os.urandom(32).hex()
+TOKEN_MAX_AGE = int(os.environ.get('SCENARIO_TOKEN_MAX_AGE', 24 * 3600))
+
+SERIALIZER = URLSafeTimedSerializer(SECRET_KEY)
+SESSIONS = Signer(SECRET_KEY, salt='scenario-session')
+
+
+class BadToken(Exception):
+    pass
+
+
+def dumps_state(problem, scenario_state):
+    # Only the values go into the token, in the problem's state_keys order
+    values = [float(scenario_state[k]) for k in problem.state_keys]
+    return SERIALIZER.dumps(values, salt=problem.kind)
+
+
+def loads_state(problem, token):
+    try:
+        values = SERIALIZER.loads(token, max_age=TOKEN_MAX_AGE, salt=problem.kind)
+    except BadSignature as e:
+        raise BadToken(f'Invalid scenario token: {e}')
+
+    if not isinstance(values, list) or len(values) != len(problem.state_keys):
+        raise BadToken('Invalid scenario token: malformed payload')
+    return dict(zip(problem.state_keys, values))
+
+
+def new_session():
+    # Random session id, signed so that only ids issued here are accepted:
+    # others can neither be guessed nor chosen by clients
+    return SESSIONS.sign(secrets.token_urlsafe(16)).decode()
+
+
+def valid_session(session):
+    try:
+        SESSIONS.unsign(session)
+    except BadSignature:
+        return False
+    return True
@@ -0,0 +1,79 @@
+import numpy as np
+
+
+class TrajectoryRecorder():
+    # Records (t, x, y, z) rows into preallocated (chunk_size, 4) arrays
+    # instead of growing one Python list per column; a new chunk is allocated
+    # whenever the current one fills up. Callers record one row every
+    # `stride` steps. With a max_points budget, a full recorder halves its
+    # rows, keeping the lowest and highest point of every four, and doubles
+    # its stride, so memory stays bounded however long the flight is.
+    def __init__(self, stride=1, max_points=None, chunk_size=4096, dtype=np.float64):
+        if max_points is not None and max_points < 8:
+            raise ValueError('max_points must be at least 8')
+
+        self.stride = stride
+        self.max_points = max_points
+        self.chunk_size = chunk_size if max_points is None else min(chunk_size, max_points)
+        self.dtype = dtype
+
+        self.chunks = []
+        self.chunk = None  # being filled, up to row self.filled
+        self.filled = 0
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def nbytes(self):
+        current = 0 if self.chunk is None else self.chunk.nbytes
+        return sum(chunk.nbytes for chunk in self.chunks) + current
+
+    def record(self, t, x, y, z):
+        if self.n == self.max_points:
+            self._decimate()
+
+        if self.chunk is None:
+            self.chunk = np.empty((self.chunk_size, 4), dtype=self.dtype)
+        self.chunk[self.filled] = (t, x, y, z)
+        self.filled += 1
+        self.n += 1
+        if self.filled == self.chunk_size:
+            self._pack()
+
+    def _pack(self):
+        # Moves the rows of the current chunk to self.chunks
+        if self.filled:
+            self.chunks.append(self.chunk[:self.filled])
+        self.chunk = None
+        self.filled = 0
+
+    def _decimate(self):
+        # Keep the first row and, for every bucket of four following rows, the
+        # rows with the lowest and highest z (in their original order)
+        rows = self.to_array().T
+        head, body = rows[:1], rows[1:]
+        n_buckets = len(body) // 4
+        buckets = body[:n_buckets * 4].reshape(n_buckets, 4, 4)
+
+        z = buckets[:, :, 3]
+        lo, hi = np.argmin(z, axis=1), np.argmax(z, axis=1)
+        first, second = np.minimum(lo, hi), np.maximum(lo, hi)
+        idx = np.arange(n_buckets)
+        kept = np.stack([buckets[idx, first], buckets[idx, second]], axis=1)
+        distinct = np.stack([np.ones(n_buckets, dtype=bool), first != second], axis=1)
+
+        rows = np.concatenate([head, kept[distinct], body[n_buckets * 4:]])
+        self.chunks = [rows]
+        self.n = len(rows)
+        self.stride *= 2
+
+    def to_array(self):
+        # Recorded rows as a (4, N) array of t, x, y, z
+        self._pack()
+        if not self.chunks:
+            return np.empty((4, 0), dtype=self.dtype)
+        if len(self.chunks) > 1:
+            self.chunks = [np.concatenate(self.chunks)]
+        return self.chunks[0].T
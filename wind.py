@@ -0,0 +1,107 @@
+import numpy as np
+
+
+class WindField():
+    # Wind velocity over altitude and time, tabulated once on a regular grid
+    # of values (nz, nt, 3) from z = 0 to z_max and t = 0 to t_max, and
+    # interpolated bilinearly. Outside the grid the nearest edge applies.
+    #
+    # Projectile.advance samples it cell by cell (see cell()), and so does
+    # BatchProjectile, for all its rows at once (see cells()). A constant
+    # wind stays a plain (3, ) array, which keeps the step loops as they were.
+    def __init__(self, values, z_max, t_max):
+        self.values = np.asarray(values, dtype=np.float64)
+        nz, nt, _ = self.values.shape
+        if nz < 2 or nt < 2:
+            raise ValueError('A wind field needs at least 2 x 2 grid points')
+        self.z_max = float(z_max)
+        self.t_max = float(t_max)
+        self.z_step = self.z_max / (nz - 1)
+        self.t_step = self.t_max / (nt - 1)
+
+    @classmethod
+    def log_law(cls, wind, z_ref=10.0, roughness=0.03, gust=0.0, gust_time=2.0,
+                z_max=5000.0, t_max=120.0, shape=(256, 256), seed=None):
+        # Horizontal wind with speed `wind` at height z_ref, sheared with
+        # altitude by the log law u(z) = u(z_ref) log(z / z0) / log(z_ref / z0)
+        # (zero below the roughness length z0), and scaled over time by a gust
+        # factor 1 + gust * n(t), n being smooth unit noise with correlation
+        # time gust_time
+        nz, nt = shape
+        z = np.linspace(0, z_max, nz)
+        profile = np.log(np.maximum(z, roughness) / roughness) / np.log(z_ref / roughness)
+
+        rng = np.random.default_rng(seed)
+        a = np.exp(-t_max / (nt - 1) / gust_time)
+        noise = np.empty(nt)
+        noise[0] = rng.standard_normal()
+        for k, e in enumerate(rng.standard_normal(nt - 1), 1):
+            noise[k] = a * noise[k - 1] + np.sqrt(1 - a * a) * e
+        factor = 1 + gust * noise
+
+        wind = np.asarray(wind, dtype=np.float64)
+        values = profile[:, None, None] * factor[None, :, None] * wind
+        return cls(values, z_max, t_max)
+
+    def _index(self, x, step, n):
+        # Cell and fraction within it along one axis, clamped to the grid
+        f = np.clip(np.asarray(x, dtype=np.float64) / step, 0, n - 1)
+        i = np.minimum(f.astype(np.int64), n - 2)
+        return i, f - i
+
+    def __call__(self, z, t):
+        # Wind at altitudes z and times t (broadcast), shape (..., 3)
+        nz, nt, _ = self.values.shape
+        iz, fz = self._index(z, self.z_step, nz)
+        it, ft = self._index(t, self.t_step, nt)
+        iz, fz, it, ft = np.broadcast_arrays(iz, fz, it, ft)
+        fz, ft = fz[..., None], ft[..., None]
+        v = self.values
+        return (
+            (1 - fz) * ((1 - ft) * v[iz, it] + ft * v[iz, it + 1]) +
+            fz * ((1 - ft) * v[iz + 1, it] + ft * v[iz + 1, it + 1])
+        )
+
+    def cell(self, z, t):
+        # The grid cell holding (z, t), for scalar loops to evaluate the wind
+        # there with a few multiplications until they leave it:
+        #   (z_lo, z_hi, t_hi, z0, t0, z_scale, t_scale, coefficients)
+        # where, with u = (z - z0) * z_scale and v = (t - t0) * t_scale,
+        # component k of the wind is c0[k] + c1[k] u + c2[k] v + c3[k] u v.
+        # Beyond an edge of the grid the cell is unbounded on that side and
+        # the wind does not vary along that axis.
+        z_lo, z_hi, t_hi, z0, t0, coefficients = self.cells(z, t)
+        return (
+            float(z_lo), float(z_hi), float(t_hi), float(z0), float(t0),
+            1 / self.z_step, 1 / self.t_step, coefficients.tolist()
+        )
+
+    def cells(self, z, t):
+        # cell() of many points at once (z and t broadcast), as arrays: the
+        # same arithmetic, so that BatchProjectile rows see the very same
+        # wind as Projectile. Coefficients have shape (..., 3, 4).
+        z, t = np.broadcast_arrays(np.asarray(z, dtype=np.float64), np.asarray(t, dtype=np.float64))
+        nz, nt, _ = self.values.shape
+        inf = float('inf')
+
+        below, above = z < 0, z >= self.z_max
+        iz = np.minimum((np.where(below | above, 0.0, z) / self.z_step).astype(np.int64), nz - 2)
+        iz = np.where(below, 0, np.where(above, nz - 1, iz))
+        jz = np.where(below | above, iz, iz + 1)
+        z_lo = np.where(below, -inf, np.where(above, self.z_max, iz * self.z_step))
+        z_hi = np.where(below, 0.0, np.where(above, inf, jz * self.z_step))
+        z0 = np.where(below, 0.0, np.where(above, self.z_max, iz * self.z_step))
+
+        late = t >= self.t_max
+        it = np.minimum(
+            (np.maximum(np.where(late, 0.0, t), 0.0) / self.t_step).astype(np.int64), nt - 2
+        )
+        it = np.where(late, nt - 1, it)
+        jt = np.where(late, it, it + 1)
+        t_hi = np.where(late, inf, jt * self.t_step)
+        t0 = np.where(late, self.t_max, it * self.t_step)
+
+        v = self.values
+        v00, v01, v10, v11 = v[iz, it], v[iz, jt], v[jz, it], v[jz, jt]
+        coefficients = np.stack([v00, v10 - v00, v01 - v00, v11 - v10 - v01 + v00], axis=-1)
+        return z_lo, z_hi, t_hi, z0, t0, coefficients